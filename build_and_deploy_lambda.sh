@@ -5,6 +5,7 @@ rm -rf kinesis-stream-processor.zip packages
 #pip install --target ./packages dependencies/botocore-1.29.162-py3-none-any.whl dependencies/boto3-1.26.162-py3-none-any.whl 
 pip install --target ./packages  urllib3==1.26.15 boto3
 cd packages && zip -r ../kinesis-stream-processor.zip . 
-cd .. && zip kinesis-stream-processor.zip lambda_function.py 
+cd .. && zip kinesis-stream-processor.zip *.py
+zip -j kinesis-stream-processor.zip ../subscriptions.py ../stream_backend.py ../play_schema.py ../wire_format.py
 aws lambda update-function-code --function-name bedrock-play-by-play-commentary-processor --zip-file fileb://kinesis-stream-processor.zip
 rm -rf kinesis-stream-processor.zip
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import time
+
+commentary_artifact_key = "COMMENTARY_ARTIFACT"
+artifact_format = "commentary-artifact"
+artifact_version = 1
+
+
+def dataset_digest(path):
+    """ :return: SHA-256 of the dataset file, an artifact only replays the dataset it was generated from """
+    with open(path, 'rb') as dataset_file:
+        return hashlib.sha256(dataset_file.read()).hexdigest()
+
+
+def write_artifact(path, dataset, commentary_objs, **meta):
+    """
+    Writes the commentaries generated for every play of a dataset.
+
+    The artifact is a JSON lines file: a header describing the dataset and the generation,
+    then one line per play with its index in the dataset and its commentary objects, as the
+    lambda function publishes them. It is written to a temporary file and renamed, so a
+    replaying UI never reads a partial artifact.
+    :param path: artifact file
+    :param dataset: CSV file the plays were read from
+    :param commentary_objs: list of the commentary objects of every play, in dataset order
+    :param meta: extra header fields, e.g. the model
+    """
+    header = dict(meta, format=artifact_format, version=artifact_version, dataset=dataset,
+                  dataset_sha256=dataset_digest(dataset), plays=len(commentary_objs), created=round(time.time(), 3))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as artifact_file:
+        artifact_file.write(json.dumps(header) + "\n")
+        for play_index, play_commentary_objs in enumerate(commentary_objs):
+            artifact_file.write(json.dumps({'play_index': play_index, 'commentary_objs': [
+                {key: commentary_obj[key] for key in ('commentary', 'style', 'language')}
+                for commentary_obj in play_commentary_objs]}) + "\n")
+    os.replace(tmp_path, path)
+
+
+class CommentaryArtifact(object):
+    """
+    Commentaries pregenerated for a known game, indexed by play index, style and language.
+    """
+
+    def __init__(self, header, plays):
+        """
+        :param header: header of the artifact, see write_artifact
+        :param plays: list of the commentary objects of every play, in dataset order
+        """
+        self.header = header
+        self.plays = plays
+        self.index = {(play_index, commentary_obj['style'], commentary_obj['language']): commentary_obj['commentary']
+                      for play_index, play_commentary_objs in enumerate(plays)
+                      for commentary_obj in play_commentary_objs}
+
+    @classmethod
+    def load(cls, path, dataset=None):
+        """
+        :param path: artifact file
+        :param dataset: optional CSV file the artifact must have been generated from
+        :return: CommentaryArtifact of the file
+        """
+        with open(path) as artifact_file:
+            header = json.loads(artifact_file.readline())
+            if header.get('format') != artifact_format or header.get('version') != artifact_version:
+                raise ValueError(f"{path} is not a version {artifact_version} commentary artifact")
+            plays = [None] * header['plays']
+            for line in artifact_file:
+                play = json.loads(line)
+                plays[play['play_index']] = play['commentary_objs']
+        if None in plays:
+            raise ValueError(f"{path} is missing the commentaries of play {plays.index(None)}")
+        if dataset is not None and header['dataset_sha256'] != dataset_digest(dataset):
+            raise ValueError(f"{path} was generated from another version of {dataset}")
+        return cls(header, plays)
+
+    def __len__(self):
+        return len(self.plays)
+
+    def commentary(self, play_index, style, language):
+        """ :return: the commentary of a play for a style and language, or None """
+        return self.index.get((play_index, style, language))
+
+    def commentary_objs(self, play_index):
+        """ :return: the commentary objects of a play, empty for plays beyond the artifact """
+        if play_index >= len(self.plays):
+            return []
+        return self.plays[play_index]
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError
+from functools import lru_cache
+from play_schema import read_plays
+from stream_backend import KinesisStream
+
+sample_input_csv = "data/simulated_game.csv"
+kinesis_data_stream_key = "SPORT_COMMENTARY_KINESIS_DATA_STREAM_SRC"
+kinesis_data_stream = os.getenv(kinesis_data_stream_key, "sports-data-live-stream-src")
+play_interval = 15 # seconds of game time between two plays
+game_duration = 60 * 5 # seconds of game time a simulated game runs, None plays the whole dataset
+flush_interval = 0.1 # seconds plays are buffered before they are sent as one batch
+
+
+@lru_cache(maxsize=None)
+def load_plays(path=sample_input_csv):
+    """
+    Parses the dataset once; the rows are shared by every simulated game.
+    :param path: CSV file of the game
+    :return: tuple of the plays as PlayRecord, see play_schema.py
+    """
+    return read_plays(path)
+
+
+class GameHandle(object):
+    """
+    Handle of a game scheduled on a SimulatorEngine.
+    """
+
+    def __init__(self, game_id, future):
+        self.game_id = game_id
+        self.future = future
+
+    def stop(self):
+        self.future.cancel()
+
+    def running(self):
+        return not self.future.done()
+
+
+class SimulatorEngine(object):
+    """
+    Runs many simulated games concurrently on one asyncio event loop.
+
+    The dataset is parsed once and shared by all games. Every game replays it at its own
+    speed: 1 is real time, 10 ten times faster and 0 as fast as possible. The plays of all
+    games are buffered for flush_interval seconds and sent to the stream in batches.
+    """
+
+    def __init__(self, kinesis, max_games=None):
+        """
+        :param kinesis: KinesisStream the plays are sent to
+        :param max_games: optional maximum number of concurrently running games
+        """
+        self.kinesis = kinesis
+        self.max_games = max_games
+        self.games = {}
+        self.sent = 0
+        self.failed = 0
+        self.loop = None
+        self.thread = None
+        self.buffer = []
+        self.flush_task = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """ Starts the event loop in a background thread. """
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self.thread = threading.Thread(target=self._run_loop, args=(ready,), name="simulator-engine", daemon=True)
+            self.thread.start()
+        ready.wait()
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.flush_task = self.loop.create_task(self._flush_loop())
+        self.loop.call_soon(ready.set)
+        self.loop.run_forever()
+
+    def start_game(self, game_id, sess_id=None, speed=1.0, duration=game_duration, partition_key=None, emit=None):
+        """
+        Schedules a game on the engine, replacing a running game with the same ID.
+        :param game_id: ID of the game
+        :param sess_id: session ID to publish the data to
+        :param speed: time compression factor, 0 plays as fast as possible
+        :param duration: seconds of game time after which the game ends, None plays the whole dataset
+        :param partition_key: optional partition key of the game's records, defaults to the game_id of the run
+        :param emit: optional function called on the event loop with every play instead of sending it to the stream
+        :return: GameHandle of the game
+        """
+        self.start()
+        for finished in [game.game_id for game in list(self.games.values()) if not game.running()]:
+            self.games.pop(finished, None)
+        if self.max_games is not None and len(self.games) >= self.max_games and game_id not in self.games:
+            raise RuntimeError(f"The maximum of {self.max_games} simulated games is reached")
+        if game_id in self.games:
+            self.games[game_id].stop()
+        # every run of a game gets its own ID, the UI orders the plays of a run by their play_seq
+        run_id = f"{game_id}-{uuid.uuid4().hex[:8]}"
+        future = asyncio.run_coroutine_threadsafe(self._play(run_id, sess_id, speed, duration, partition_key, emit),
+                                                  self.loop)
+        handle = GameHandle(game_id, future)
+        self.games[game_id] = handle
+        return handle
+
+    def stop_game(self, game_id):
+        if game_id in self.games:
+            self.games.pop(game_id).stop()
+
+    def running_games(self):
+        return sum(1 for game in list(self.games.values()) if game.running())
+
+    async def _play(self, run_id, sess_id, speed, duration, partition_key, emit):
+        interval = play_interval / speed if speed else 0
+        for index, row in enumerate(load_plays()):
+            if duration is not None and index * play_interval >= duration:
+                break
+            record = row.to_dict()
+            record['game_id'] = run_id
+            record['play_seq'] = index
+            if sess_id:
+                record['sess_id'] = sess_id
+            # wall clock timestamps of the stages the play goes through, see tracing.py
+            record['trace'] = {'emit': round(time.time(), 3)}
+            if emit is not None:
+                emit(record)
+            else:
+                self.buffer.append((record, partition_key))
+            await asyncio.sleep(interval)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("failed to send the buffered plays")
+
+    async def flush(self):
+        """ Sends the buffered plays of every game as one batch. """
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        failed = len(await self.loop.run_in_executor(None, self.kinesis.send_stream_batch, batch))
+        self.sent += len(batch) - failed
+        self.failed += failed
+        if failed:
+            logging.warning(f"failed to send {failed} of {len(batch)} plays")
+
+    async def _close(self):
+        self.flush_task.cancel()
+        try:
+            await self.flush_task
+        except asyncio.CancelledError:
+            pass
+        await self.flush()
+
+    def wait(self):
+        """ Blocks until every scheduled game has ended. """
+        for game in list(self.games.values()):
+            try:
+                game.future.result()
+            except (CancelledError, Exception):
+                pass
+
+    def shutdown(self):
+        """ Stops every game, sends the buffered plays and stops the event loop. """
+        if self.thread is None:
+            return
+        for game_id in list(self.games):
+            self.stop_game(game_id)
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.thread = None
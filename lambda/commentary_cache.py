@@ -0,0 +1,175 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(model_id, request):
+    """
+    Content address of a model request.
+    :param model_id: model identifier the request is sent to
+    :param request: request body, including the prompt and the inference parameters
+    :return: hex digest identifying the request
+    """
+    payload = json.dumps({"modelId": model_id, "request": request}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SqliteCommentaryStore(object):
+    """
+    Persistent cache tier backed by a local SQLite file.
+
+    Only get, put and evict are used by CommentaryCache, so a shared store (e.g. DynamoDB or
+    Redis) can replace it by implementing the same methods. get returns the value and the time
+    it was stored, and get(key, allow_stale=True) also returns expired entries, for the fallback
+    when the model cannot be reached.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        """
+        :param path: SQLite database file
+        :param ttl: seconds an entry stays valid, None to keep entries forever
+        :param max_entries: maximum number of stored entries, None for no limit
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS commentary_cache "
+                           "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS commentary_cache_created ON commentary_cache (created)")
+        self._conn.commit()
+
+    def get(self, key, allow_stale=False):
+        """ :return: (value, created) of the entry, or None """
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM commentary_cache WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if not allow_stale and self.ttl is not None and time.time() - created > self.ttl:
+            return None
+        return value, created
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO commentary_cache (key, value, created) VALUES (?, ?, ?)",
+                               (key, value, time.time()))
+            self._conn.commit()
+
+    def evict(self):
+        """ Drops expired entries and trims the store down to max_entries, oldest first. """
+        with self._lock:
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM commentary_cache WHERE created < ?", (time.time() - self.ttl,))
+            if self.max_entries is not None:
+                self._conn.execute("DELETE FROM commentary_cache WHERE key NOT IN "
+                                   "(SELECT key FROM commentary_cache ORDER BY created DESC LIMIT ?)",
+                                   (self.max_entries,))
+            self._conn.commit()
+
+
+class CommentaryCache(object):
+    """
+    Two tier cache for generated commentaries.
+
+    The first tier is an in-memory LRU that survives across warm Lambda invocations, the
+    optional second tier is a persistent store such as SqliteCommentaryStore.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, store=None):
+        """
+        :param max_entries: capacity of the in-memory tier, 0 disables the cache, including the store
+        :param ttl: seconds an in-memory entry stays valid, None to keep entries until evicted
+        :param store: optional persistent tier
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: cache key from make_cache_key
+        :return: the cached commentary or None
+        """
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if self.ttl is None or time.time() - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                # expired entries stay until they are evicted, get_stale may still serve them
+        if self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                value, created = entry
+                with self._lock:
+                    self.store_hits += 1
+                    self.hits += 1
+                    # the entry keeps the age it has in the store, so it still expires after ttl
+                    self._insert(key, value, created)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get_stale(self, key):
+        """
+        Looks up a commentary regardless of its age, as a fallback when the model cannot be reached.
+        :param key: cache key from make_cache_key
+        :return: the cached commentary or None
+        """
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.stale_hits += 1
+                return entry[0]
+        if self.store is not None:
+            entry = self.store.get(key, allow_stale=True)
+            if entry is not None:
+                with self._lock:
+                    self.stale_hits += 1
+                return entry[0]
+        return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._insert(key, value)
+        if self.store is not None:
+            self.store.put(key, value)
+
+    def _insert(self, key, value, created=None):
+        self._entries[key] = (value, time.time() if created is None else created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "store_hits": self.store_hits,
+                "evictions": self.evictions,
+                "stale_hits": self.stale_hits,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,290 @@
+from play_schema import as_play_record, display_value, flag_cols
+
+template_modes = ("template", "auto", "llm")
+# name of the empty play_type (end of quarter rows) in COMMENTARY_TEMPLATE_POLICY
+end_of_quarter_name = "end_of_quarter"
+
+quarter_names = {
+    "English": {"1": "the first quarter", "2": "the second quarter", "3": "the third quarter",
+                "4": "the fourth quarter", "5": "overtime"},
+    "Spanish": {"1": "el primer cuarto", "2": "el segundo cuarto", "3": "el tercer cuarto",
+                "4": "el cuarto cuarto", "5": "la prórroga"},
+    "German": {"1": "des ersten Viertels", "2": "des zweiten Viertels", "3": "des dritten Viertels",
+               "4": "des vierten Viertels", "5": "der Verlängerung"},
+}
+yard_units = {"English": ("yard", "yards"), "Spanish": ("yarda", "yardas"), "German": ("Yard", "Yards")}
+
+# one sentence per play outcome and language; {yards}, {kick_yards} and {return_units} include the unit
+phrases = {
+    'end_of_quarter': {
+        "English": "That's the end of {quarter_name}, {total_home_score} to {total_away_score}.",
+        "Spanish": "Termina {quarter_name}, {total_home_score} a {total_away_score}.",
+        "German": "Ende {quarter_name}, Spielstand {total_home_score} zu {total_away_score}.",
+    },
+    'extra_point_good': {
+        "English": "{kicker_player_name} converts the extra point for {posteam}.",
+        "Spanish": "{kicker_player_name} convierte el punto extra para {posteam}.",
+        "German": "{kicker_player_name} verwandelt den Extrapunkt für {posteam}.",
+    },
+    'extra_point_missed': {
+        "English": "{kicker_player_name} misses the extra point.",
+        "Spanish": "{kicker_player_name} falla el punto extra.",
+        "German": "{kicker_player_name} vergibt den Extrapunkt.",
+    },
+    'penalty': {
+        "English": "Flag on the play: {penalty_type} on {penalty_team}, {penalty_yards}.",
+        "Spanish": "Bandera en la jugada: {penalty_type} contra {penalty_team}, {penalty_yards}.",
+        "German": "Flagge auf dem Feld: {penalty_type} gegen {penalty_team}, {penalty_yards}.",
+    },
+    'no_play': {
+        "English": "No play, {posteam} will line up again.",
+        "Spanish": "Jugada anulada, {posteam} vuelve a alinearse.",
+        "German": "Kein Spielzug, {posteam} stellt sich neu auf.",
+    },
+    'pass_incomplete_to': {
+        "English": "{passer_player_name}'s pass to {receiver_player_name} falls incomplete.",
+        "Spanish": "El pase de {passer_player_name} a {receiver_player_name} es incompleto.",
+        "German": "Der Pass von {passer_player_name} auf {receiver_player_name} ist unvollständig.",
+    },
+    'pass_incomplete': {
+        "English": "{passer_player_name}'s pass falls incomplete.",
+        "Spanish": "El pase de {passer_player_name} es incompleto.",
+        "German": "Der Pass von {passer_player_name} ist unvollständig.",
+    },
+    'pass_complete': {
+        "English": "{passer_player_name} finds {receiver_player_name} for {yards}.",
+        "Spanish": "{passer_player_name} encuentra a {receiver_player_name} para {yards}.",
+        "German": "{passer_player_name} findet {receiver_player_name} für {yards}.",
+    },
+    'run_stuffed': {
+        "English": "{rusher_player_name} is stopped at the line by {defteam}.",
+        "Spanish": "{rusher_player_name} es detenido en la línea por {defteam}.",
+        "German": "{rusher_player_name} wird von {defteam} an der Linie gestoppt.",
+    },
+    'run_gain': {
+        "English": "{rusher_player_name} runs for {yards}.",
+        "Spanish": "{rusher_player_name} corre {yards}.",
+        "German": "{rusher_player_name} läuft {yards}.",
+    },
+    'punt': {
+        "English": "{punter_player_name} punts it away, {kick_yards}.",
+        "Spanish": "{punter_player_name} despeja el balón, {kick_yards}.",
+        "German": "{punter_player_name} puntet den Ball, {kick_yards}.",
+    },
+    'kickoff_return': {
+        "English": "{kicker_player_name} kicks off for {defteam}, {kickoff_returner_player_name} brings it back {return_units}.",
+        "Spanish": "{kicker_player_name} patea para {defteam}, {kickoff_returner_player_name} la devuelve {return_units}.",
+        "German": "{kicker_player_name} kickt für {defteam} ab, {kickoff_returner_player_name} trägt den Ball {return_units} zurück.",
+    },
+    'kickoff': {
+        "English": "{kicker_player_name} kicks off for {defteam}.",
+        "Spanish": "{kicker_player_name} patea para {defteam}.",
+        "German": "{kicker_player_name} kickt für {defteam} ab.",
+    },
+    'field_goal_made': {
+        "English": "{kicker_player_name} is good from {kick_yards}!",
+        "Spanish": "¡{kicker_player_name} anota el gol de campo desde {kick_yards}!",
+        "German": "{kicker_player_name} trifft das Field Goal aus {kick_yards}!",
+    },
+    'field_goal_missed': {
+        "English": "{kicker_player_name} misses the field goal from {kick_yards}.",
+        "Spanish": "{kicker_player_name} falla el gol de campo desde {kick_yards}.",
+        "German": "{kicker_player_name} vergibt das Field Goal aus {kick_yards}.",
+    },
+    'touchdown': {
+        "English": "Touchdown {posteam}!",
+        "Spanish": "¡Touchdown de {posteam}!",
+        "German": "Touchdown {posteam}!",
+    },
+    'sack': {
+        "English": "{defteam} get the sack!",
+        "Spanish": "¡Captura de {defteam}!",
+        "German": "Sack durch {defteam}!",
+    },
+}
+
+# score sentence of the NFL style, left out when the row has no score
+score_sentences = {
+    "English": " Score {total_home_score}-{total_away_score}.",
+    "Spanish": " Marcador {total_home_score}-{total_away_score}.",
+    "German": " Spielstand {total_home_score}:{total_away_score}.",
+}
+# how each style frames the sentences of a play
+style_frames = {
+    "NFL": {
+        "English": "{text}{score}",
+        "Spanish": "{text}{score}",
+        "German": "{text}{score}",
+    },
+    "tweeter": {
+        "English": "{text} #NFL #GameDay",
+        "Spanish": "{text} #NFL #DíaDePartido",
+        "German": "{text} #NFL #Spieltag",
+    },
+    "poetic": {
+        "English": "Beneath the stadium lights: {text}",
+        "Spanish": "Bajo las luces del estadio: {text}",
+        "German": "Unter dem Flutlicht des Stadions: {text}",
+    },
+}
+
+
+def is_eventful(values):
+    return values['touchdown'] or values['sack'] or values['penalty']
+
+
+def is_completed(values):
+    return values['complete_pass']
+
+
+def yards_at_most(limit):
+    return lambda values: values['yards_gained'] is not None and values['yards_gained'] <= limit
+
+
+def result_in(field, results):
+    return lambda values: values.get(field) in results
+
+
+# rules of every play type: (phrase, required fields, condition, routine), the first rule whose fields are
+# set and whose condition holds describes the play; only routine rules are used in the "auto" mode
+play_rules = {
+    '': (
+        ('end_of_quarter', ('qtr', 'total_home_score', 'total_away_score'), None, True),
+    ),
+    'extra_point': (
+        ('extra_point_good', ('kicker_player_name', 'posteam'), result_in('extra_point_result', ("good",)), True),
+        ('extra_point_missed', ('kicker_player_name',), None, True),
+    ),
+    'no_play': (
+        ('penalty', ('penalty_type', 'penalty_team', 'penalty_yards'), lambda values: values['penalty'], True),
+        ('no_play', ('posteam',), lambda values: not is_eventful(values), True),
+    ),
+    'pass': (
+        ('pass_incomplete_to', ('passer_player_name', 'receiver_player_name'),
+         lambda values: not is_completed(values) and not is_eventful(values), True),
+        ('pass_incomplete', ('passer_player_name',),
+         lambda values: not is_completed(values) and not is_eventful(values), True),
+        ('pass_complete', ('passer_player_name', 'receiver_player_name', 'yards_gained'), is_completed, False),
+        ('pass_incomplete_to', ('passer_player_name', 'receiver_player_name'), None, False),
+        ('pass_incomplete', ('passer_player_name',), None, False),
+    ),
+    'run': (
+        ('run_stuffed', ('rusher_player_name', 'defteam'),
+         lambda values: yards_at_most(0)(values) and not is_eventful(values), True),
+        ('run_gain', ('rusher_player_name', 'yards_gained'),
+         lambda values: yards_at_most(2)(values) and not is_eventful(values), True),
+        ('run_gain', ('rusher_player_name', 'yards_gained'), None, False),
+    ),
+    'punt': (
+        ('punt', ('punter_player_name', 'kick_distance'), lambda values: not is_eventful(values), True),
+        ('punt', ('punter_player_name', 'kick_distance'), None, False),
+    ),
+    'kickoff': (
+        ('kickoff_return', ('kicker_player_name', 'defteam', 'kickoff_returner_player_name', 'return_yards'), None, False),
+        ('kickoff', ('kicker_player_name', 'defteam'), None, False),
+    ),
+    'field_goal': (
+        ('field_goal_made', ('kicker_player_name', 'kick_distance'), result_in('field_goal_result', ("made",)), False),
+        ('field_goal_missed', ('kicker_player_name', 'kick_distance'), None, False),
+    ),
+}
+# sentences added after the play's sentence when a rule that is not routine describes it
+outcome_rules = (
+    ('touchdown', ('posteam',), lambda values: values['touchdown']),
+    ('sack', ('defteam',), lambda values: values['sack']),
+    ('penalty', ('penalty_type', 'penalty_team', 'penalty_yards'), lambda values: values['penalty']),
+)
+
+
+def parse_template_policy(spec):
+    """
+    Parses COMMENTARY_TEMPLATE_POLICY, e.g. "*=auto,kickoff=llm,field_goal=llm".
+    :param spec: comma separated play_type=mode pairs; "*" sets the mode of the other play types and
+                 end_of_quarter names the rows without play type
+    :return: dictionary of the mode of every listed play type, "*" included
+    """
+    policy = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        play_type, _, mode = item.partition("=")
+        play_type, mode = play_type.strip(), mode.strip()
+        if mode not in template_modes:
+            raise ValueError(f"Unknown template mode {mode!r} for {play_type!r}, expected one of {template_modes}")
+        policy["" if play_type == end_of_quarter_name else play_type] = mode
+    return policy
+
+
+def template_mode(policy, row):
+    """
+    :param policy: parsed policy, see parse_template_policy
+    :param row: dictionary that describes the play
+    :return: "template" to always use the templates, "auto" to use them for routine plays only, or "llm"
+    """
+    play_type = str(row.get('play_type') or "").strip()
+    return policy.get(play_type, policy.get("*", "llm"))
+
+
+def play_values(row):
+    """
+    :param row: PlayRecord, or dictionary that describes the play
+    :return: the row's non empty fields as the dataset writes them, with the flags as booleans and yards_gained as int
+    """
+    row = as_play_record(row)
+    values = {key: display_value(value) for key, value in row.items() if value is not None}
+    values.update((flag, row[flag]) for flag in flag_cols)
+    values['yards_gained'] = row['yards_gained'] if isinstance(row['yards_gained'], int) else None
+    return values
+
+
+def select_phrases(values, routine_only):
+    """
+    :param values: see play_values
+    :param routine_only: only describe plays that a routine rule matches
+    :return: the phrase keys that describe the play, or None if no rule matches
+    """
+    for phrase, fields, condition, routine in play_rules.get(values.get('play_type', ""), ()):
+        if routine_only and not routine:
+            continue
+        if all(values.get(field) not in (None, "") for field in fields) and (condition is None or condition(values)):
+            if routine:
+                return [phrase]
+            return [phrase] + [outcome for outcome, outcome_fields, outcome_condition in outcome_rules
+                               if outcome != phrase and outcome_condition(values)
+                               and all(values.get(field) for field in outcome_fields)]
+    return None
+
+
+def with_units(number, language):
+    singular, plural = yard_units[language]
+    return f"{number} {singular if str(number) in ('1', '-1') else plural}"
+
+
+def render_commentaries(row, combinations, routine_only):
+    """
+    Writes the commentaries of a play from the templates, without a model call.
+    :param row: dictionary that describes the play
+    :param combinations: (style, language) tuples to write
+    :param routine_only: only write the commentaries of plays that a routine rule matches
+    :return: dictionary of the commentary of every combination, or None if the templates
+             do not describe the play or one of the styles or languages
+    """
+    values = play_values(row)
+    selected = select_phrases(values, routine_only)
+    if selected is None:
+        return None
+    commentaries = {}
+    for style, language in combinations:
+        if style not in style_frames or language not in yard_units:
+            return None
+        localized = dict(values, quarter_name=quarter_names[language].get(values.get('qtr'), values.get('qtr')),
+                         yards=with_units(values['yards_gained'], language),
+                         kick_yards=with_units(values.get('kick_distance'), language),
+                         return_units=with_units(values.get('return_yards'), language),
+                         penalty_yards=with_units(values.get('penalty_yards'), language))
+        localized['score'] = ""
+        if values.get('total_home_score') is not None and values.get('total_away_score') is not None:
+            localized['score'] = score_sentences[language].format(**values)
+        text = " ".join(phrases[phrase][language].format(**localized) for phrase in selected)
+        commentaries[(style, language)] = style_frames[style][language].format(text=text, **localized)
+    return commentaries
@@ -0,0 +1,105 @@
+import collections
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from botocore.exceptions import ClientError
+from play_encoding import count_tokens
+
+json_keys_pattern = re.compile(r"JSON object whose keys are (\[[^\]]*\])")
+
+
+class FakeBedrockClient(object):
+    """
+    Local stand-in for the bedrock-runtime client.
+
+    It answers invoke_model with an AI21 Jurassic shaped response after a delay, so the
+    commentary pipeline can be exercised and timed without network access.
+    invoke_model_with_response_stream streams the same answer word by word over the delay,
+    after a first token latency. A share of the calls, or the calls above a rate limit, can be
+    rejected with a ThrottlingException, like Bedrock does when the account quota is exceeded. Prompts
+    asking for a JSON object (see generate_multi_prompts) are answered with one fake
+    commentary per requested key.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, throttle_rate=0.0, seed=None, input_token_latency=0.0,
+                 first_token_share=0.2, rate_limit=None):
+        """
+        :param latency: seconds each invoke_model call takes
+        :param jitter: maximum number of seconds randomly added to the latency
+        :param throttle_rate: share of the calls, between 0 and 1, rejected with a ThrottlingException
+        :param seed: optional seed making the jitter and throttling reproducible
+        :param input_token_latency: seconds added to a call for every token of its prompt
+        :param first_token_share: share of the latency until a streamed response sends its first word
+        :param rate_limit: optional calls per second accepted over a sliding second, the others are throttled
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.input_token_latency = input_token_latency
+        self.first_token_share = first_token_share
+        self.rate_limit = rate_limit
+        self._accepted = collections.deque()
+        self.calls = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _answer(self, body, modelId):
+        """ :return: prompt, generated text and delay of a call, raising a ThrottlingException for throttled calls """
+        request = json.loads(body)
+        prompt = request['prompt']
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter) + self.input_token_latency * count_tokens(prompt)
+            throttled = self._random.random() < self.throttle_rate
+            if self.rate_limit is not None and not throttled:
+                now = time.monotonic()
+                while self._accepted and self._accepted[0] <= now - 1:
+                    self._accepted.popleft()
+                throttled = len(self._accepted) >= self.rate_limit
+                if not throttled:
+                    self._accepted.append(now)
+            if throttled:
+                self.throttled += 1
+        if throttled:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait before trying again."},
+                               "ResponseMetadata": {"HTTPStatusCode": 429}}, "InvokeModel")
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8]
+        text = f"Fake commentary {digest} from {modelId}."
+        keys = json_keys_pattern.search(prompt)
+        if keys:
+            text = json.dumps({key: f"{key}: {text}" for key in json.loads(keys.group(1))})
+        return prompt, text, delay
+
+    def invoke_model(self, body, modelId, accept="*/*", contentType="application/json"):
+        prompt, text, delay = self._answer(body, modelId)
+        time.sleep(delay)
+        response_body = {"completions": [{"data": {"text": " " + text}}]}
+        headers = {
+            "x-amzn-bedrock-input-token-count": str(count_tokens(prompt)),
+            "x-amzn-bedrock-output-token-count": str(count_tokens(text)),
+        }
+        return {
+            "ResponseMetadata": {"HTTPHeaders": headers},
+            "body": io.BytesIO(json.dumps(response_body).encode('utf-8')),
+        }
+
+    def invoke_model_with_response_stream(self, body, modelId, accept="*/*", contentType="application/json"):
+        prompt, text, delay = self._answer(body, modelId)
+        return {"ResponseMetadata": {"HTTPHeaders": {}}, "body": self._stream(prompt, text, delay)}
+
+    def _stream(self, prompt, text, delay):
+        words = text.split(" ")
+        time.sleep(delay * self.first_token_share)
+        for index, word in enumerate(words):
+            chunk = {"completions": [{"data": {"text": " " + word}}]}
+            if index == len(words) - 1:
+                chunk["amazon-bedrock-invocationMetrics"] = {"inputTokenCount": count_tokens(prompt),
+                                                             "outputTokenCount": count_tokens(text)}
+            yield {"chunk": {"bytes": json.dumps(chunk).encode('utf-8')}}
+            if index < len(words) - 1:
+                time.sleep(delay * (1 - self.first_token_share) / (len(words) - 1))
@@ -2,28 +2,117 @@ import base64
 import json
 import os
 import logging
-import uuid
-import boto3
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from botocore.exceptions import BotoCoreError, ClientError
+from commentary_cache import CommentaryCache, SqliteCommentaryStore, make_cache_key
+from commentary_templates import parse_template_policy, render_commentaries, template_mode
+from play_encoding import count_tokens, encode_play
+from play_schema import PlayRecord, as_play_record
+from rate_limiter import AdaptiveRateLimiter, DeadlineExceeded
+from subscriptions import get_subscription_registry
+from stream_backend import KinesisStream, encode_json
+from wire_format import encode_record
 
 sm_endpoint_name = os.getenv('SM_ENDPOINT_NAME', "j2-jumbo-instruct")
 down_dict = {1: "first down", 2: "second down", 3: "third down", 4: "forth down"}
 quarter_dict = {1: "first quarter", 2: "second quarter", 3: "third quarter", 4: "forth quarter", 5: "overtime"}
 styles = ["NFL", "tweeter", "poetic"]
 languages = ["English", "Spanish", "German"]
-cols = [ 'yrdln', 'time', 'qtr', 'total_home_score', 'total_away_score', 'play_type',
-     'posteam', 'defteam', 'down', 'yards_gained', 'drive', 'sack', 'complete_pass',
-     'penalty', 'penalty_team', 'penalty_player_name', 'penalty_yards', 'penalty_type',
-     'kick_distance', 'return_yards', 'kicker_player_name', 'kickoff_returner_player_name',
-     'pass_length', 'ydstogo','passer_player_name', 'receiver_player_name', 'rusher_player_name',
-     'solo_tackle_1_player_name', 'assist_tackle_1_player_name', 'punter_player_name',
-     'field_goal_result', 'extra_point_result', 'touchdown'
-]
 kinesis_data_stream_key = "SPORT_DATA_LIVE_COMMENTARIES_STREAM"
 kinesis_data_stream = os.getenv(kinesis_data_stream_key, "sports-data-live-commentaries")
 #bedrock_model_id = "ai21.j2-jumbo-instruct"
 bedrock_model_id = "ai21.j2-ultra-v1"
+# number of model calls per play that may be in flight at the same time; 1 restores sequential generation
+commentary_concurrency = int(os.getenv("COMMENTARY_CONCURRENCY", len(styles) * len(languages)))
+# seconds to wait for the model calls of a play past its deadline before giving up on the calls still running
+commentary_call_timeout = float(os.getenv("COMMENTARY_CALL_TIMEOUT", "10"))
+# seconds a play may spend on its model calls, including rate limiting and retries
+commentary_play_deadline = float(os.getenv("COMMENTARY_PLAY_DEADLINE", "20"))
+# "template" replaces a commentary whose model call failed with a stale cached one, or else the play line;
+# "none" fails the play so that Kinesis retries it
+commentary_fallback = os.getenv("COMMENTARY_FALLBACK", "template")
+# optional cap of the model calls per second of the container, the limiter only limits them after the first throttle without it
+model_rate_max = float(os.getenv("MODEL_RATE_MAX")) if os.getenv("MODEL_RATE_MAX") else None
+model_rate_min = float(os.getenv("MODEL_RATE_MIN", "0.5"))
+# attempts per model call and base delay in seconds of the jittered exponential backoff between them
+model_max_attempts = int(os.getenv("MODEL_MAX_ATTEMPTS", "4"))
+model_retry_base_delay = float(os.getenv("MODEL_RETRY_BASE_DELAY", "0.2"))
+throttling_error_codes = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+retryable_error_codes = throttling_error_codes | {"ServiceUnavailableException", "InternalServerException",
+                                                  "ModelNotReadyException", "ModelTimeoutException"}
+usage_counters = ("model_calls", "cache_hits", "input_tokens", "output_tokens", "retries", "throttles", "fallbacks",
+                  "queue_ms")
+# set to the simulated latency in seconds to use the local fake model instead of Bedrock, FAKE_BEDROCK_JITTER,
+# FAKE_BEDROCK_THROTTLE_RATE, FAKE_BEDROCK_SEED, FAKE_BEDROCK_INPUT_TOKEN_LATENCY and FAKE_BEDROCK_RATE_LIMIT tune it
+fake_bedrock_latency_key = "FAKE_BEDROCK_LATENCY"
+# in-memory commentary cache capacity (0 disables caching, including the SQLite tier) and entry lifetime in seconds (empty keeps entries)
+commentary_cache_size = int(os.getenv("COMMENTARY_CACHE_SIZE", "1024"))
+commentary_cache_ttl = float(os.getenv("COMMENTARY_CACHE_TTL")) if os.getenv("COMMENTARY_CACHE_TTL") else None
+# optional SQLite file for the persistent cache tier, e.g. /tmp/commentary_cache.db
+commentary_cache_db = os.getenv("COMMENTARY_CACHE_DB")
+commentary_cache_db_size = int(os.getenv("COMMENTARY_CACHE_DB_SIZE", "100000"))
+# "single" asks the model for each style and language combination separately, "styles" asks for all
+# styles of a language in one call and "languages" for all languages of a style in one call
+commentary_prompt_mode = os.getenv("COMMENTARY_PROMPT_MODE", "single")
+# generated tokens allowed per commentary in the multi-output prompt modes
+multi_commentary_max_tokens = int(os.getenv("MULTI_COMMENTARY_MAX_TOKENS", "80"))
+# "compact" describes the play with the templates of play_encoding.py, "json" embeds describe_play as JSON
+prompt_encoding = os.getenv("PROMPT_ENCODING", "compact")
+single_prompt_templates = {
+    "json": "{play} \n As a professional sportscaster, write a {style} style commentary in {language} using 2 sentences",
+    "compact": "{play}\nWrite a 2 sentence {style} style sportscaster commentary in {language}.",
+}
+# "1" streams the model responses with invoke_model_with_response_stream
+commentary_streaming = os.getenv("COMMENTARY_STREAMING", "0") == "1"
+# "1" publishes every style and language combination of a play as soon as it is generated, tagged with the play ID
+commentary_early_publish = os.getenv("COMMENTARY_EARLY_PUBLISH", "0") == "1"
+# with streaming and early publishing, seconds between two partial texts published for a combination (unset publishes none)
+commentary_partial_interval = float(os.getenv("COMMENTARY_PARTIAL_INTERVAL")) if os.getenv("COMMENTARY_PARTIAL_INTERVAL") else None
+# per play type choice between the templates of commentary_templates.py and the model, e.g. "*=auto,kickoff=llm":
+# "template" always writes the commentaries from templates, "auto" only for routine plays, "llm" always calls the model
+commentary_template_policy = parse_template_policy(os.getenv("COMMENTARY_TEMPLATE_POLICY", ""))
+fast_path_stats = {"plays": 0, "fast_path": 0}
+fast_path_lock = threading.Lock()
+# number of records of a batch that are processed at the same time
+record_concurrency = int(os.getenv("RECORD_CONCURRENCY", "4"))
+# "binary" publishes the commentary records in the layout of wire_format.py, "json" as plain JSON
+commentary_wire_format = os.getenv("COMMENTARY_WIRE_FORMAT", "binary")
+# body size in bytes above which a binary record is compressed (empty never compresses)
+commentary_wire_compress_threshold = int(os.getenv("COMMENTARY_WIRE_COMPRESS_THRESHOLD", "1024")) \
+    if os.getenv("COMMENTARY_WIRE_COMPRESS_THRESHOLD", "1024") else None
+# "1" keeps the prompt of every commentary in the published records, for debugging
+commentary_wire_prompts = os.getenv("COMMENTARY_WIRE_PROMPTS", "0") == "1"
+
+# retries are scheduled by generate_commentary_with_usage, within the deadline of the play
+bedrock_client_retries = {"total_max_attempts": 1, "mode": "standard"}
+# seconds before the ASSUMABLE_ROLE_ARN credentials expire at which the bedrock client is rebuilt with new ones
+credentials_refresh_margin = float(os.getenv("CREDENTIALS_REFRESH_MARGIN", "300"))
+# "1" builds the bedrock client (importing boto3, assuming ASSUMABLE_ROLE_ARN) in a background thread started at
+# import, "0" on the first model call
+bedrock_client_warmup = os.getenv("BEDROCK_CLIENT_WARMUP", "1") == "1"
+
 
 def get_bedrock_client():
+    """
+    Builds a bedrock client. boto3 is imported here rather than with the module, it is the bulk
+    of the cold start and the fake model does not need it.
+    :return: the client and the time.time() at which its credentials expire, None if boto3 refreshes them
+    """
+    if fake_bedrock_latency_key in os.environ:
+        from fake_bedrock import FakeBedrockClient
+        bedrock = FakeBedrockClient(latency=float(os.environ[fake_bedrock_latency_key]),
+                                    jitter=float(os.getenv("FAKE_BEDROCK_JITTER", "0")),
+                                    throttle_rate=float(os.getenv("FAKE_BEDROCK_THROTTLE_RATE", "0")),
+                                    seed=os.getenv("FAKE_BEDROCK_SEED"),
+                                    input_token_latency=float(os.getenv("FAKE_BEDROCK_INPUT_TOKEN_LATENCY", "0")),
+                                    rate_limit=float(os.getenv("FAKE_BEDROCK_RATE_LIMIT")) if os.getenv("FAKE_BEDROCK_RATE_LIMIT") else None)
+        return bedrock, None
+    import boto3
+    from botocore.config import Config
+    config = Config(retries=bedrock_client_retries)
     if "ASSUMABLE_ROLE_ARN" in os.environ:
         session = boto3.Session()
         sts = session.client("sts")
@@ -35,20 +124,91 @@ def get_bedrock_client():
                               aws_secret_access_key=response['Credentials']['SecretAccessKey'],
                               aws_session_token=response['Credentials']['SessionToken'])
 
-        bedrock = new_session.client('bedrock-runtime' , 'us-east-1')
-    else:
-        bedrock = boto3.client("bedrock-runtime", "us-east-1")
-    return bedrock
+        bedrock = new_session.client('bedrock-runtime' , 'us-east-1', config=config)
+        return bedrock, response['Credentials']['Expiration'].timestamp()
+    return boto3.client("bedrock-runtime", "us-east-1", config=config), None
 
-boto3_bedrock = get_bedrock_client()
 
-def generate_prompts(row):
+def get_bedrock():
     """
-    Prompt generator based on the given row.
-    :param row: dictionary that describes the play.
+    Returns the bedrock client shared by the model calls of the container. It is built on first
+    use and rebuilt credentials_refresh_margin seconds before the assumed role credentials expire.
+    """
+    global boto3_bedrock, bedrock_credentials_expiry
+    with bedrock_client_lock:
+        if boto3_bedrock is None or (bedrock_credentials_expiry is not None
+                                     and time.time() > bedrock_credentials_expiry - credentials_refresh_margin):
+            boto3_bedrock, bedrock_credentials_expiry = get_bedrock_client()
+        return boto3_bedrock
+
+
+def warm_up_bedrock():
+    try:
+        get_bedrock()
+    except Exception as error:
+        logging.warning(f"building the bedrock client failed with {type(error).__name__}, retrying on the first model call")
+
+
+def get_commentary_cache():
+    store = None
+    if commentary_cache_db:
+        store = SqliteCommentaryStore(commentary_cache_db, ttl=commentary_cache_ttl,
+                                      max_entries=commentary_cache_db_size)
+    return CommentaryCache(max_entries=commentary_cache_size, ttl=commentary_cache_ttl, store=store)
+
+
+boto3_bedrock = None
+bedrock_credentials_expiry = None
+bedrock_client_lock = threading.Lock()
+commentary_cache = get_commentary_cache()
+model_rate_limiter = AdaptiveRateLimiter(max_rate=model_rate_max, min_rate=model_rate_min,
+                                         burst=commentary_concurrency)
+subscription_registry = get_subscription_registry()
+executors = {}
+if bedrock_client_warmup:
+    threading.Thread(target=warm_up_bedrock, name="bedrock-warmup", daemon=True).start()
+
+
+def get_executor(name, max_workers):
+    """
+    Returns a named thread pool, kept across warm invocations.
+    :param name: purpose of the pool, used as thread name prefix
+    :param max_workers: maximum number of concurrent tasks
+    :return: thread pool executor
+    """
+    key = (name, max_workers)
+    if key not in executors:
+        executors[key] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+    return executors[key]
+
+
+def new_usage(**counters):
+    """
+    :param counters: counters to set
+    :return: model usage dictionary with every counter of usage_counters, see generate_commentary_with_usage
+    """
+    usage = dict.fromkeys(usage_counters, 0)
+    usage.update(counters)
+    return usage
+
 
-    :return: curated prompt based on the given row.
+def log_metric(name, **fields):
     """
+    Prints a metric as a single JSON log line, so it can be extracted with CloudWatch Logs Insights.
+    :param name: metric name
+    :param fields: metric dimensions and values
+    """
+    print(json.dumps({"metric": name, **fields}))
+
+
+def describe_play(row):
+    """
+    Builds the play description that is embedded in the prompts.
+    :param row: PlayRecord, or dictionary that describes the play.
+
+    :return: dictionary of the play facts relevant for the commentary.
+    """
+    row = as_play_record(row)
 
     prompt = {}
     prompt['starting_yard_line'] = row['yrdln']
@@ -59,18 +219,19 @@ def generate_prompts(row):
     offensive_team = row['posteam']
     defensive_team = row['defteam']
 
+    down = None
     if str(row['down']).isnumeric():
         down = down_dict[int(row['down'])]
     yards_gained = row['yards_gained']
     if row['time'] == '15:00':
         prompt['new quarter'] = True
-    if row['touchdown'] == 1:
+    if row['touchdown']:
         prompt['touchdown'] = "touchdown"
         prompt['number of drive'] = row['drive']
-    if row['sack'] == 1:
+    if row['sack']:
         prompt['sacked'] = 'sacked'
 
-    if row['penalty'] == 1:
+    if row['penalty']:
         prompt['is penalty'] = True
         prompt['penalty team'] = row['penalty_team']
         prompt['penalty player'] = row['penalty_player_name']
@@ -90,14 +251,15 @@ def generate_prompts(row):
         prompt['play_type'] = play_type
         prompt['offensive_team'] = offensive_team
         prompt['defensive_team'] = defensive_team
-        prompt['down'] = down
+        if down is not None:
+            prompt['down'] = down
         prompt['pass_length'] = row['pass_length']
-        if row['touchdown'] != 1:
+        if not row['touchdown'] and down is not None:
             prompt[f"{down} with yards to go"] = row['ydstogo']
         prompt['passer_player_name'] = row['passer_player_name']
         prompt['receiver_player_name'] = row['receiver_player_name']
         prompt['passing_yards_gained'] = yards_gained
-        if row['complete_pass'] == 1:
+        if row['complete_pass']:
             prompt['completion'] = "complete pass"
         else:
             prompt['completion'] = "incomplete pass"
@@ -111,7 +273,8 @@ def generate_prompts(row):
         prompt['tackle_2_player_name'] = row['assist_tackle_1_player_name']
     elif play_type == "punt":
         prompt['play_type'] = play_type
-        prompt[f"{down} with yards to go"] = row['ydstogo']
+        if down is not None:
+            prompt[f"{down} with yards to go"] = row['ydstogo']
         prompt['offensive_team'] = offensive_team
         prompt['defensive_team'] = defensive_team
         prompt['punt_distance'] = row['kick_distance']
@@ -120,7 +283,8 @@ def generate_prompts(row):
         prompt['play_type'] = play_type
         prompt['offensive_team'] = offensive_team
         prompt['defensive_team'] = defensive_team
-        prompt[f"{down} with yards to go"] = row['ydstogo']
+        if down is not None:
+            prompt[f"{down} with yards to go"] = row['ydstogo']
         prompt['field_goal_result'] = row['field_goal_result']
         prompt['kick_distance'] = row['kick_distance']
         prompt['kicker_player_name'] = row['kicker_player_name']
@@ -130,34 +294,219 @@ def generate_prompts(row):
         prompt['extra_point_result'] = row['extra_point_result']
         prompt['kicker_player_name'] = row['kicker_player_name']
 
-    elif play_type != play_type:  # nan
+    elif not play_type:  # empty in the CSV
         prompt['offensive_team'] = offensive_team
         prompt['defensive_team'] = defensive_team
         prompt['end_of_the_quarter'] = True
 
+    return prompt
+
+
+def play_description(row, encoding=None):
+    """
+    Describes the play for the prompts.
+    :param row: dictionary that describes the play.
+    :param encoding: "compact" or "json", defaults to PROMPT_ENCODING
+
+    :return: play description
+    """
+    if (encoding or prompt_encoding) == "json":
+        return json.dumps(describe_play(row))
+    return "Play: " + encode_play(row)
+
+
+def generate_prompts(row, combinations=None, encoding=None):
+    """
+    Prompt generator based on the given row.
+    :param row: dictionary that describes the play.
+    :param combinations: optional set of the (style, language) tuples to generate prompts for, defaults to all
+    :param encoding: "compact" or "json", defaults to PROMPT_ENCODING
+
+    :return: curated prompt based on the given row, with its estimated number of prompt_tokens.
+    """
+
+    play = play_description(row, encoding)
+    template = single_prompt_templates[encoding or prompt_encoding]
     prompt_objs = []
     for style in styles:
         for language in languages:
+            if combinations is not None and (style, language) not in combinations:
+                continue
             prompt_obj = {}
             prompt_obj['language'] = language
             prompt_obj['style'] = style
-            prompt_str = f"{json.dumps(prompt)} \n As a professional sportscaster, write a {style} style commentary in {language} using 2 sentences"
+            prompt_str = template.format(play=play, style=style, language=language)
             prompt_obj['prompt'] = prompt_str
+            prompt_obj['prompt_tokens'] = count_tokens(prompt_str)
             prompt_objs.append(prompt_obj)
     return prompt_objs
 
 
-def generate_commentary(prompt):
+def generate_multi_prompts(row, prompt_mode, combinations=None, encoding=None):
     """
-    Returns the generated commentary for a given prompt.
+    Prompt generator asking for several commentaries of the play in a single model call.
+    :param row: dictionary that describes the play.
+    :param prompt_mode: "styles" for one prompt per language covering every style, or
+                        "languages" for one prompt per style covering every language.
+    :param combinations: optional set of the (style, language) tuples to generate prompts for, defaults to all
+    :param encoding: "compact" or "json", defaults to PROMPT_ENCODING
+
+    :return: prompt objects; 'keys' maps each key of the requested JSON answer to its (style, language).
+    """
+
+    def wanted(style, language):
+        return combinations is None or (style, language) in combinations
+
+    play = play_description(row, encoding)
+    prompt_objs = []
+    if prompt_mode == "styles":
+        for language in languages:
+            language_styles = [style for style in styles if wanted(style, language)]
+            if not language_styles:
+                continue
+            prompt_obj = {}
+            prompt_obj['keys'] = {style: (style, language) for style in language_styles}
+            prompt_obj['prompt'] = f"{play} \n As a professional sportscaster, write a commentary in {language} using 2 sentences " \
+                                   f"for each of the styles {', '.join(language_styles)}. Answer only with a JSON object whose keys are " \
+                                   f"{json.dumps(language_styles)} and whose values are the commentaries"
+            prompt_obj['prompt_tokens'] = count_tokens(prompt_obj['prompt'])
+            prompt_objs.append(prompt_obj)
+    elif prompt_mode == "languages":
+        for style in styles:
+            style_languages = [language for language in languages if wanted(style, language)]
+            if not style_languages:
+                continue
+            prompt_obj = {}
+            prompt_obj['keys'] = {language: (style, language) for language in style_languages}
+            prompt_obj['prompt'] = f"{play} \n As a professional sportscaster, write a {style} style commentary using 2 sentences " \
+                                   f"in each of the languages {', '.join(style_languages)}. Answer only with a JSON object whose keys are " \
+                                   f"{json.dumps(style_languages)} and whose values are the commentaries"
+            prompt_obj['prompt_tokens'] = count_tokens(prompt_obj['prompt'])
+            prompt_objs.append(prompt_obj)
+    else:
+        raise ValueError(f"Unknown prompt mode: {prompt_mode}")
+    return prompt_objs
+
+
+def parse_multi_commentary(text, keys):
+    """
+    Extracts the commentaries from the JSON answer to a prompt of generate_multi_prompts.
+    :param text: generated text
+    :param keys: expected keys of the JSON object
+    :return: dictionary of the commentaries found, keys that are missing or empty are left out
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        answer = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(answer, dict):
+        return {}
+    return {key: answer[key].strip() for key in keys
+            if isinstance(answer.get(key), str) and answer[key].strip()}
+
+
+def get_token_counts(response, response_body):
+    """
+    Reads the input and output token counts of a model response.
+    :param response: invoke_model response
+    :param response_body: decoded response body
+    :return: tuple of input and output token counts
+    """
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    if 'x-amzn-bedrock-input-token-count' in headers:
+        return (int(headers['x-amzn-bedrock-input-token-count']),
+                int(headers.get('x-amzn-bedrock-output-token-count', 0)))
+    input_tokens = len(response_body.get('prompt', {}).get('tokens', []))
+    output_tokens = len(response_body['completions'][0]['data'].get('tokens', []))
+    return input_tokens, output_tokens
+
+
+def get_chunk_text(chunk):
+    """
+    Reads the text of a response stream chunk, in the AI21, Anthropic or Titan format.
+    :param chunk: decoded chunk
+    :return: generated text of the chunk
+    """
+    if 'completions' in chunk:
+        return chunk['completions'][0]['data']['text']
+    return chunk.get('completion') or chunk.get('outputText') or ""
+
+
+def invoke_model_streaming(body, on_text=None):
+    """
+    Calls the model with invoke_model_with_response_stream.
+    :param body: request body
+    :param on_text: optional function called with the text generated so far after every chunk
+    :return: tuple of the generated text and the input and output token counts
+    """
+    response = get_bedrock().invoke_model_with_response_stream(body=body, modelId=bedrock_model_id, accept="*/*",
+                                                               contentType="application/json")
+    text, input_tokens, output_tokens = "", 0, 0
+    for event in response['body']:
+        if 'chunk' not in event:
+            continue
+        chunk = json.loads(event['chunk']['bytes'])
+        text += get_chunk_text(chunk)
+        metrics = chunk.get('amazon-bedrock-invocationMetrics')
+        if metrics:
+            input_tokens, output_tokens = metrics.get('inputTokenCount', 0), metrics.get('outputTokenCount', 0)
+        if on_text is not None and text.strip():
+            on_text(text.lstrip())
+    return text.lstrip(), input_tokens, output_tokens
+
+
+def call_model(body, on_text=None):
+    """
+    Invokes the model once.
+    :param body: request body
+    :param on_text: optional function called with the text generated so far while the response streams in
+    :return: tuple of the generated text and the input and output token counts
+    """
+    if commentary_streaming:
+        return invoke_model_streaming(body, on_text)
+    response = get_bedrock().invoke_model(body=body, modelId=bedrock_model_id, accept="*/*",
+                                          contentType="application/json")
+    response_body = json.loads(response.get('body').read())
+    input_tokens, output_tokens = get_token_counts(response, response_body)
+    return response_body['completions'][0]['data']['text'][1:], input_tokens, output_tokens
+
+
+def is_retryable(error):
+    """ :return: whether a failed model call may succeed when it is repeated """
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in retryable_error_codes
+    return isinstance(error, BotoCoreError)
+
+
+def is_throttled(error):
+    """ :return: whether a model call was rejected because of the request rate """
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in throttling_error_codes
+
+
+def generate_commentary_with_usage(prompt, max_tokens=50, on_text=None, deadline=None):
+    """
+    Returns the generated commentary for a given prompt and the model usage it caused.
+
+    The model is called with temperature 0, so identical requests are answered from
+    commentary_cache instead of invoking the model again. Every call waits for model_rate_limiter,
+    throttled and transient errors are retried with jittered exponential backoff until
+    MODEL_MAX_ATTEMPTS or the deadline is reached. If the model still fails, an expired cached
+    commentary of the same request is returned when there is one.
+
     :param prompt: prompt that gets fed into the model for commentary generation.
-    :return: generated text
+    :param max_tokens: maximum number of generated tokens
+    :param on_text: optional function called with the text generated so far while the response streams in
+    :param deadline: optional time.monotonic() value after which no call is started or retried
+    :return: generated text and a dictionary with the counters of usage_counters, plus the start and end
+             timestamps of the model_call if the model was invoked
     """
-    global boto3_bedrock
 
     request = {
         "prompt": prompt,
-        "maxTokens":50,
+        "maxTokens":max_tokens,
         "temperature":0,
         "topP":1.0,
         "stopSequences":[],
@@ -165,33 +514,290 @@ def generate_commentary(prompt):
         "presencePenalty":{"scale":0},
         "frequencyPenalty":{"scale":0}
     }
+    cache_key = make_cache_key(bedrock_model_id, request)
+    commentary_text = commentary_cache.get(cache_key)
+    if commentary_text is not None:
+        return commentary_text, new_usage(cache_hits=1)
+
     body = json.dumps(request)
-    content_type = "application/json"
-    response = boto3_bedrock.invoke_model(body=body, modelId=bedrock_model_id, accept="*/*",
-                                          contentType=content_type)
-    response_body = json.loads(response.get('body').read())
-    commentary_text = response_body['completions'][0]['data']['text'][1:]
-    return commentary_text
+    usage = new_usage(model_calls=1)
+    attempt = 1
+    while True:
+        try:
+            usage["queue_ms"] += model_rate_limiter.acquire(deadline) * 1000
+            started = time.time()
+            commentary_text, usage["input_tokens"], usage["output_tokens"] = call_model(body, on_text)
+            break
+        except (ClientError, BotoCoreError, DeadlineExceeded) as error:
+            if is_throttled(error):
+                model_rate_limiter.on_throttle()
+                usage["throttles"] += 1
+            # full jitter, so that the calls throttled together do not come back together
+            delay = random.uniform(0, model_retry_base_delay * 2 ** (attempt - 1))
+            if (not is_retryable(error) or attempt >= model_max_attempts
+                    or (deadline is not None and time.monotonic() + delay > deadline)):
+                commentary_text = commentary_cache.get_stale(cache_key)
+                if commentary_text is None:
+                    raise
+                logging.warning(f"model call failed with {type(error).__name__}, using an expired cached commentary")
+                usage["fallbacks"] = 1
+                return commentary_text, usage
+            attempt += 1
+            usage["retries"] += 1
+            time.sleep(delay)
+    model_rate_limiter.on_success()
+    commentary_cache.put(cache_key, commentary_text)
+    usage["model_call"] = [round(started, 3), round(time.time(), 3)]
+    return commentary_text, usage
 
 
-def get_commentaries(row):
+def generate_commentary(prompt):
+    """
+    Returns the generated commentary for a given prompt.
+    :param prompt: prompt that gets fed into the model for commentary generation.
+    :return: generated text
+    """
+    return generate_commentary_with_usage(prompt)[0]
+
+
+def generate_all(prompts, max_tokens, concurrency, on_results=None, on_texts=None, deadline=None):
+    """
+    Runs the model calls for several prompts, fanned out over a bounded thread pool.
+    :param prompts: prompts to generate
+    :param max_tokens: maximum number of generated tokens for each prompt
+    :param concurrency: maximum number of concurrent model calls
+    :param on_results: optional functions, one per prompt, called with (text, usage) as soon as the prompt is generated
+    :param on_texts: optional functions, one per prompt, called with the partial text while the response streams in
+    :param deadline: optional time.monotonic() value after which no model call is started or retried
+    :return: list of (text, usage) in the order of the prompts; with COMMENTARY_FALLBACK enabled the text
+             of a failed prompt is None, otherwise the first failure is raised
+    """
+    # calls that time out keep running in the executor, they must not hand over their commentary once
+    # generate_all has returned: the play's complete record may already be published
+    handover = {'done': False, 'active': 0}
+    handover_condition = threading.Condition()
+
+    def hand_over(callback, *args):
+        with handover_condition:
+            if handover['done'] or (deadline is not None and time.monotonic() > deadline):
+                return
+            handover['active'] += 1
+        try:
+            callback(*args)
+        except Exception:
+            logging.exception("failed to hand over an early commentary")
+        finally:
+            with handover_condition:
+                handover['active'] -= 1
+                handover_condition.notify_all()
+
+    def finish():
+        # hand-overs in progress complete before the play's complete record is built
+        with handover_condition:
+            handover['done'] = True
+            handover_condition.wait_for(lambda: handover['active'] == 0, commentary_call_timeout)
+
+    def generate(index):
+        on_text = None
+        if on_texts:
+            on_text = lambda text: hand_over(on_texts[index], text)
+        try:
+            result = generate_commentary_with_usage(prompts[index], max_tokens[index], on_text, deadline)
+        except Exception as error:
+            if commentary_fallback == "none":
+                raise
+            logging.warning(f"model call failed with {type(error).__name__}: {error}, "
+                            f"the commentary falls back to a template")
+            return None, new_usage()
+        if on_results:
+            hand_over(on_results[index], *result)
+        return result
+
+    if concurrency <= 1:
+        try:
+            return [generate(index) for index in range(len(prompts))]
+        finally:
+            finish()
+
+    executor = get_executor("commentary", concurrency)
+    futures = [executor.submit(generate, index) for index in range(len(prompts))]
+    # one bound for the whole play: the calls run concurrently, their timeouts must not add up
+    wait_until = time.monotonic() + commentary_call_timeout
+    if deadline is not None:
+        # calls may queue for the rate limiter and retry until the deadline
+        wait_until += max(deadline - time.monotonic(), 0)
+    results = []
+    try:
+        _, not_done = wait(futures, timeout=max(wait_until - time.monotonic(), 0))
+        for future in futures:
+            try:
+                if future in not_done:
+                    raise TimeoutError("model call timed out")
+                results.append(future.result())
+            except Exception:
+                if commentary_fallback == "none":
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                future.cancel()
+                logging.warning("model call timed out, the commentary falls back to a template")
+                results.append((None, new_usage()))
+    finally:
+        finish()
+    return results
+
+
+def fallback_commentary(row, style, language):
+    """
+    Commentary used when the model cannot generate one for a play in time.
+    :param row: dictionary that describes the play
+    :param style: commentary style
+    :param language: commentary language
+    :return: the commentary of the templates of commentary_templates.py, or else the facts of
+             the play in one line, in English whatever the language
+    """
+    texts = render_commentaries(row, [(style, language)], routine_only=False)
+    if texts is not None:
+        return texts[(style, language)]
+    return encode_play(row) + "."
+
+
+def make_commentary_obj(row, style, language, text, prompt, model_call=None):
+    """
+    :return: commentary object of a style and language combination, as published to the UI
+    """
+    commentary_obj = {}
+    commentary_obj['commentary'] = f"({row['time']}) {text}"
+    commentary_obj['style'] = style
+    commentary_obj['language'] = language
+    if commentary_wire_prompts:
+        # the prompts repeat the play for every combination, they are left out of the stream by default
+        commentary_obj['prompt'] = prompt
+    # start and end of the model call that generated the commentary, None if it came from the cache
+    commentary_obj['model_call'] = model_call
+    return commentary_obj
+
+
+def get_template_commentaries(row, combinations, routine_only):
+    """
+    Writes the commentaries of a play from the templates of commentary_templates.py.
+    :param row: data ingested from the stream
+    :param combinations: optional set of the (style, language) tuples to write, defaults to all
+    :param routine_only: only write them if the play is routine
+    :return: commentary objects in the order of generate_prompts, or None if the play needs the model
+    """
+    wanted = [(style, language) for style in styles for language in languages
+              if combinations is None or (style, language) in combinations]
+    texts = render_commentaries(row, wanted, routine_only)
+    if texts is None:
+        return None
+    return [make_commentary_obj(row, style, language, texts[(style, language)], None) for style, language in wanted]
+
+
+def count_fast_path(fast_path):
+    with fast_path_lock:
+        fast_path_stats["plays"] += 1
+        fast_path_stats["fast_path"] += int(fast_path)
+
+
+def get_commentaries(row, concurrency=None, prompt_mode=None, combinations=None, on_commentary=None, on_partial=None):
     """
     Create commentaries from the input data.
 
+    The model calls for the style and language combinations are fanned out over a bounded
+    thread pool; the returned objects keep the order of generate_prompts. In the "styles" and
+    "languages" prompt modes several combinations are generated by one call, combinations
+    missing from its answer are generated with their own prompt. Plays that
+    COMMENTARY_TEMPLATE_POLICY assigns to the templates take the fast path without model calls.
+
     :param row: data ingested from the stream
+    :param concurrency: maximum number of concurrent model calls, defaults to COMMENTARY_CONCURRENCY
+    :param prompt_mode: "single", "styles" or "languages", defaults to COMMENTARY_PROMPT_MODE
+    :param combinations: optional set of the (style, language) tuples to generate, defaults to all
+    :param on_commentary: optional function called with each commentary object as soon as it is generated
+    :param on_partial: optional function called with commentary objects holding the partial text of a
+                       streaming single-combination call
     :return: commentary objects
     """
-    prompt_objs = generate_prompts(row)
-    generated_commentary_objs = []
-    for prompt_obj in prompt_objs:
-        commentary_obj = {}
-        generated_commentary = f"({row['time']}) {generate_commentary(prompt_obj['prompt'])}"
-        commentary_obj['commentary'] = generated_commentary
-        commentary_obj['style'] = prompt_obj['style']
-        commentary_obj['language'] = prompt_obj['language']
-        commentary_obj['prompt'] = prompt_obj['prompt']
-        generated_commentary_objs.append(commentary_obj)
+    if concurrency is None:
+        concurrency = commentary_concurrency
+    if prompt_mode is None:
+        prompt_mode = commentary_prompt_mode
+    start = time.perf_counter()
+    mode = template_mode(commentary_template_policy, row)
+    if mode != "llm":
+        template_commentary_objs = get_template_commentaries(row, combinations, mode == "auto")
+        count_fast_path(template_commentary_objs is not None)
+        if template_commentary_objs is not None:
+            log_metric("play", prompt_mode="template", combinations=len(template_commentary_objs), fast_path=True,
+                       duration_ms=round((time.perf_counter() - start) * 1000, 3), **new_usage())
+            return template_commentary_objs
+    else:
+        count_fast_path(False)
+    deadline = time.monotonic() + commentary_play_deadline
+    usage = new_usage()
+    generated = {}
+
+    single_prompt_objs = generate_prompts(row, combinations)
+    if prompt_mode != "single":
+        multi_prompt_objs = generate_multi_prompts(row, prompt_mode, combinations)
+        on_results = None
+        if on_commentary is not None:
+            def multi_result_handler(prompt_obj):
+                def on_result(text, call_usage):
+                    for key, commentary_text in parse_multi_commentary(text, prompt_obj['keys']).items():
+                        style, language = prompt_obj['keys'][key]
+                        on_commentary(make_commentary_obj(row, style, language, commentary_text, prompt_obj['prompt'],
+                                                          call_usage.get("model_call")))
+                return on_result
+            on_results = [multi_result_handler(prompt_obj) for prompt_obj in multi_prompt_objs]
+        results = generate_all([prompt_obj['prompt'] for prompt_obj in multi_prompt_objs],
+                               [multi_commentary_max_tokens * len(prompt_obj['keys']) for prompt_obj in multi_prompt_objs],
+                               concurrency, on_results, deadline=deadline)
+        for prompt_obj, (text, call_usage) in zip(multi_prompt_objs, results):
+            for key in usage:
+                usage[key] += call_usage[key]
+            if text is None:
+                # its combinations are retried with their own prompts
+                continue
+            for key, commentary_text in parse_multi_commentary(text, prompt_obj['keys']).items():
+                generated[prompt_obj['keys'][key]] = (commentary_text, prompt_obj['prompt'], call_usage.get("model_call"))
+
+    missing_prompt_objs = [prompt_obj for prompt_obj in single_prompt_objs
+                           if (prompt_obj['style'], prompt_obj['language']) not in generated]
+    on_results, on_texts = None, None
+    if on_commentary is not None:
+        def single_result_handler(prompt_obj):
+            return lambda text, call_usage: on_commentary(make_commentary_obj(
+                row, prompt_obj['style'], prompt_obj['language'], text, prompt_obj['prompt'], call_usage.get("model_call")))
+        on_results = [single_result_handler(prompt_obj) for prompt_obj in missing_prompt_objs]
+    if on_partial is not None:
+        def single_text_handler(prompt_obj):
+            return lambda text: on_partial(make_commentary_obj(
+                row, prompt_obj['style'], prompt_obj['language'], text, prompt_obj['prompt']))
+        on_texts = [single_text_handler(prompt_obj) for prompt_obj in missing_prompt_objs]
+    results = generate_all([prompt_obj['prompt'] for prompt_obj in missing_prompt_objs],
+                           [50] * len(missing_prompt_objs), concurrency, on_results, on_texts, deadline)
+    for prompt_obj, (text, call_usage) in zip(missing_prompt_objs, results):
+        for key in usage:
+            usage[key] += call_usage[key]
+        if text is None:
+            text = fallback_commentary(row, prompt_obj['style'], prompt_obj['language'])
+            usage["fallbacks"] += 1
+        generated[(prompt_obj['style'], prompt_obj['language'])] = (text, prompt_obj['prompt'], call_usage.get("model_call"))
 
+    generated_commentary_objs = []
+    for prompt_obj in single_prompt_objs:
+        text, prompt, model_call = generated[(prompt_obj['style'], prompt_obj['language'])]
+        generated_commentary_objs.append(make_commentary_obj(row, prompt_obj['style'], prompt_obj['language'],
+                                                             text, prompt, model_call))
+
+    sent_prompt_objs = missing_prompt_objs + (multi_prompt_objs if prompt_mode != "single" else [])
+    usage["queue_ms"] = round(usage["queue_ms"], 1)
+    log_metric("play", prompt_mode=prompt_mode, encoding=prompt_encoding, combinations=len(single_prompt_objs),
+               fast_path=False, fallback_calls=len(missing_prompt_objs) if prompt_mode != "single" else 0,
+               prompt_tokens=sum(prompt_obj['prompt_tokens'] for prompt_obj in sent_prompt_objs),
+               duration_ms=round((time.perf_counter() - start) * 1000, 1), **usage)
     return generated_commentary_objs
 
 
@@ -199,71 +805,214 @@ def get_row_data(row):
     """
     Extract relevant columns from the input data.
     :param row: input data
-    :return: data filtered by the given column names
+    :return: PlayRecord of the telemetry columns, parsed into typed fields
     """
-    df_json = {}
-    for col in cols:
-        df_json[col] = row[col]
-    return df_json
-
+    return PlayRecord.from_dict(row)
 
-class KinesisStream(object):
 
-    def __init__(self, stream):
-        self.stream = stream
+def encode_commentary_record(record):
+    """ :return: the commentary record encoded for the stream, see COMMENTARY_WIRE_FORMAT """
+    if commentary_wire_format == "json":
+        return encode_json(record)
+    return encode_record(record, commentary_wire_compress_threshold)
 
-    def _connected_client(self):
-        """ Connect to Kinesis Streams """
-        return boto3.client('kinesis')
 
-    def send_stream(self, data, partition_key=None):
-        """
-        data: python dict containing your data.
-        partition_key:  set it to some fixed value if you want processing order
-                        to be preserved when writing successive records.
+kinesis = KinesisStream(kinesis_data_stream, encode=encode_commentary_record)
 
-                        If your kinesis stream has multiple shards, AWS hashes your
-                        partition key to decide which shard to send this record to.
 
-                        Ignore if you don't care for processing order
-                        or if this stream only has 1 shard.
-
-                        If your kinesis stream is small, it probably only has 1 shard anyway.
-        """
-
-        # If no partition key is given, assume random sharding for even shard write load
-        if partition_key == None:
-            partition_key = str(uuid.uuid4())
-
-        client = self._connected_client()
-        return client.put_record(
-            StreamName=self.stream,
-            Data=json.dumps(data),
-            PartitionKey=partition_key
-        )
+def get_subscribed_combinations(sess_id):
+    """
+    Looks up the style and language combinations that need to be generated for a play.
+    :param sess_id: session the play is published to, if any
+    :return: set of (style, language) tuples, or None to generate every combination
+    """
+    if subscription_registry is None:
+        return None
+    combinations = set()
+    if sess_id is not None:
+        combinations = subscription_registry.combinations(sess_id)
+    if not combinations:
+        combinations = subscription_registry.combinations()
+    # nobody is known to watch, keep generating everything rather than nothing
+    return combinations or None
+
+
+def get_play_order(data):
+    """
+    :param data: record ingested from the stream
+    :return: the game_id and play_seq of the play, which the UI orders the plays of a game by
+    """
+    return {key: data[key] for key in ('game_id', 'play_seq') if key in data}
 
 
-kinesis = KinesisStream(kinesis_data_stream)
+def get_early_publishers(sess_id, play_id, row, trace, play_order=None):
+    """
+    Builds the functions that publish the commentaries of a play one combination at a time, before
+    the whole play is generated. The UI merges them with the complete record by play ID.
+    :param sess_id: session the play is published to
+    :param play_id: ID of the play, the sequence number of its source record
+    :param row: data ingested from the stream
+    :param trace: trace of the play so far
+    :param play_order: game_id and play_seq of the play, see get_play_order
+    :return: tuple of the on_commentary and on_partial functions for get_commentaries, on_partial is
+             None unless partial texts are published
+    """
+    last_partial = {}
+    lock = threading.Lock()
+
+    def publish(commentary_obj, partial):
+        published_at = round(time.time(), 3)
+        early_record = {'sess_id': sess_id, 'play_id': play_id, 'early': True, 'partial': partial,
+                        'combination': f"{commentary_obj['style']}/{commentary_obj['language']}",
+                        'row': row, 'commentary_objs': [commentary_obj],
+                        'trace': dict(trace, generated=published_at, publish=published_at), **(play_order or {})}
+        if kinesis.send_stream_batch([(early_record, None)]):
+            # the complete record of the play still carries the commentary
+            logging.warning(f"failed to publish the early commentary of play {play_id}")
+
+    def on_commentary(commentary_obj):
+        publish(commentary_obj, False)
+
+    def on_partial(commentary_obj):
+        key = (commentary_obj['style'], commentary_obj['language'])
+        now = time.monotonic()
+        with lock:
+            if now - last_partial.get(key, 0) < commentary_partial_interval:
+                return
+            last_partial[key] = now
+        publish(commentary_obj, True)
+
+    if commentary_streaming and commentary_partial_interval is not None:
+        return on_commentary, on_partial
+    return on_commentary, None
+
+
+def process_record(record):
+    """
+    Generates the commentaries for one Kinesis record.
+    :param record: record of the Kinesis event
+    :return: the commentary record to publish, or None if the play has no session to publish to
+    """
+    received = time.time()
+    payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
+    print("Decoded payload: " + payload)
+    data = json.loads(payload)
+    row = get_row_data(data)
+    row_data = row.to_dict()
+    play_id = record['kinesis'].get('sequenceNumber')
+    # the trace started by the simulator is carried through to the UI, see tracing.py
+    trace = data.get('trace', {})
+    trace['source_arrival'] = record['kinesis'].get('approximateArrivalTimestamp')
+    trace['lambda_receive'] = round(received, 3)
+    on_commentary, on_partial = None, None
+    if commentary_early_publish and 'sess_id' in data:
+        on_commentary, on_partial = get_early_publishers(data['sess_id'], play_id, row_data, trace,
+                                                          get_play_order(data))
+    commentary_objs = get_commentaries(row, combinations=get_subscribed_combinations(data.get('sess_id')),
+                                       on_commentary=on_commentary, on_partial=on_partial)
+    trace['generated'] = round(time.time(), 3)
+    for commentary_obj in commentary_objs:
+        print(f"commentary: {commentary_obj['commentary']}")
+    commentary_row_objs = {}
+    commentary_row_objs['commentary_objs'] = commentary_objs
+    commentary_row_objs['row'] = row_data
+    commentary_row_objs['play_id'] = play_id
+    commentary_row_objs['trace'] = trace
+    # also the partition key, so the commentaries of a game stay in order on one shard
+    commentary_row_objs.update(get_play_order(data))
+    if 'sess_id' in data:
+        print(f"found session ID:{data['sess_id']}")
+        commentary_row_objs['sess_id'] = data['sess_id']
+        return commentary_row_objs
+    return None
+
+
+def timed_process_record(record):
+    """
+    Runs process_record and captures its outcome instead of raising.
+    :param record: record of the Kinesis event
+    :return: tuple of the commentary record (or None), the raised exception (or None) and the duration in seconds
+    """
+    start = time.perf_counter()
+    try:
+        return process_record(record), None, time.perf_counter() - start
+    except Exception as error:
+        logging.exception(f"failed to process record {record['kinesis'].get('sequenceNumber')}")
+        return None, error, time.perf_counter() - start
 
 
 def lambda_handler(event, context):
+   """
+   Generates and publishes the commentaries of a Kinesis batch.
+
+   Records after the first failing record are neither processed nor published; the failed
+   sequence numbers are returned as batchItemFailures so that Kinesis, with the
+   ReportBatchItemFailures response type enabled on the event source mapping, only retries
+   from the first failed record onwards instead of re-delivering the whole batch.
+   """
    print("entering lambda_handler")
 
-   for record in event['Records']:
-       payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
-       print("Decoded payload: " + payload)
-       data = json.loads(payload)
-       row = get_row_data(data)
-       commentary_objs = get_commentaries(row)
-       for commentary_obj in commentary_objs:
-           print(f"commentary: {commentary_obj['commentary']}")
-       commentary_row_objs = {}
-       commentary_row_objs['commentary_objs'] = commentary_objs
-       commentary_row_objs['row'] = row
-       if 'sess_id' in data:
-           print(f"found session ID:{data['sess_id']}")
-           commentary_row_objs['sess_id'] = data['sess_id']
-           kinesis.send_stream(commentary_row_objs)
-
-   return 'Successfully processed {} records.'.format(len(event['Records']))
-    
+   records = event['Records']
+   results = [None] * len(records)
+   if record_concurrency > 1 and len(records) > 1:
+       executor = get_executor("record", record_concurrency)
+       futures = [executor.submit(timed_process_record, record) for record in records]
+       for index, future in enumerate(futures):
+           if future.cancelled():
+               continue
+           results[index] = future.result()
+           if results[index][1] is not None:
+               # the batch is retried from here, so do not spend model calls on later records
+               for pending in futures[index + 1:]:
+                   pending.cancel()
+   else:
+       for index, record in enumerate(records):
+           results[index] = timed_process_record(record)
+           if results[index][1] is not None:
+               break
+
+   # only the records before the first failure are published, later ones are retried anyway
+   first_failure = next((index for index, result in enumerate(results)
+                         if result is None or result[1] is not None), len(records))
+   published = [index for index in range(first_failure) if results[index][0] is not None]
+   published_at = round(time.time(), 3)
+   for index in published:
+       results[index][0]['trace']['publish'] = published_at
+   sent_bytes = kinesis.sent_bytes
+   publish_failed = kinesis.send_stream_batch([(results[index][0], None) for index in published])
+   publish_failed = {published[item] for item in publish_failed}
+
+   failed_sequence_numbers = []
+   for index, record in enumerate(records):
+       sequence_number = record['kinesis'].get('sequenceNumber')
+       duration_ms = None
+       if results[index] is None:
+           outcome = "skipped"
+       else:
+           commentary_row_objs, error, duration = results[index]
+           duration_ms = round(duration * 1000, 1)
+           if error is not None:
+               outcome = f"failed:{type(error).__name__}"
+           elif index in publish_failed:
+               outcome = "publish_failed"
+           elif index >= first_failure:
+               outcome = "not_published"
+           elif commentary_row_objs is None:
+               outcome = "no_session"
+           else:
+               outcome = "published"
+       if outcome.startswith("failed") or outcome == "publish_failed":
+           failed_sequence_numbers.append(sequence_number)
+       log_metric("record", sequence_number=sequence_number, outcome=outcome, duration_ms=duration_ms)
+
+   log_metric("batch", records=len(records), published=len(published) - len(publish_failed),
+              published_bytes=kinesis.sent_bytes - sent_bytes,
+              failed=len(failed_sequence_numbers), retried_from=failed_sequence_numbers[0] if failed_sequence_numbers else None)
+   print(f"commentary cache: {json.dumps(commentary_cache.stats())}")
+   log_metric("model_limiter", **model_rate_limiter.stats())
+   with fast_path_lock:
+       log_metric("fast_path", **fast_path_stats,
+                  fraction=round(fast_path_stats["fast_path"] / fast_path_stats["plays"], 4) if fast_path_stats["plays"] else 0)
+   if commentary_cache.store is not None:
+       commentary_cache.store.evict()
+   return {"batchItemFailures": [{"itemIdentifier": sequence_number} for sequence_number in failed_sequence_numbers]}
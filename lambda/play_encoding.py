@@ -0,0 +1,100 @@
+import re
+from play_schema import as_play_record, display_value, flag_cols
+
+token_pattern = re.compile(r"\w+|[^\w\s]")
+down_names = {"1": "1st", "2": "2nd", "3": "3rd", "4": "4th"}
+quarter_names = {"1": "Q1", "2": "Q2", "3": "Q3", "4": "Q4", "5": "OT"}
+
+# a play is encoded as one line of segments; a segment is only rendered when all of its fields are set
+header_segments = (
+    ("{quarter} {time}", ('quarter', 'time')),
+    ("start of quarter", ('new_quarter',)),
+    ("score home {total_home_score} away {total_away_score}", ('total_home_score', 'total_away_score')),
+)
+situation_segments = (
+    ("{posteam} vs {defteam}", ('posteam', 'defteam')),
+    ("ball on {yrdln}", ('yrdln',)),
+    ("{down_name} & {ydstogo}", ('down_name', 'ydstogo')),
+)
+play_segments = {
+    'kickoff': (
+        ("kickoff by {defteam}", ('defteam',)),
+        ("kicker {kicker_player_name}", ('kicker_player_name',)),
+        ("{kick_distance} yds", ('kick_distance',)),
+        ("returned by {kickoff_returner_player_name}", ('kickoff_returner_player_name',)),
+        ("for {return_yards} yds", ('return_yards',)),
+    ),
+    'pass': situation_segments + (
+        ("{pass_length} pass", ('pass_length',)),
+        ("pass", ('no_pass_length',)),
+        ("{passer_player_name} to {receiver_player_name}", ('passer_player_name', 'receiver_player_name')),
+        ("{completion}", ('completion',)),
+        ("{yards_gained} yds", ('yards_gained',)),
+    ),
+    'run': situation_segments + (
+        ("run {rusher_player_name}", ('rusher_player_name',)),
+        ("{yards_gained} yds", ('yards_gained',)),
+        ("tackle {solo_tackle_1_player_name}", ('solo_tackle_1_player_name',)),
+        ("assist {assist_tackle_1_player_name}", ('assist_tackle_1_player_name',)),
+    ),
+    'punt': situation_segments + (
+        ("punt {punter_player_name}", ('punter_player_name',)),
+        ("{kick_distance} yds", ('kick_distance',)),
+    ),
+    'field_goal': situation_segments + (
+        ("field goal {kicker_player_name}", ('kicker_player_name',)),
+        ("{kick_distance} yds", ('kick_distance',)),
+        ("{field_goal_result}", ('field_goal_result',)),
+    ),
+    'extra_point': (
+        ("{posteam} vs {defteam}", ('posteam', 'defteam')),
+        ("extra point {kicker_player_name}", ('kicker_player_name',)),
+        ("{extra_point_result}", ('extra_point_result',)),
+    ),
+    'no_play': situation_segments + (
+        ("no play", ()),
+    ),
+    '': (
+        ("{posteam} vs {defteam}", ('posteam', 'defteam')),
+        ("end of quarter", ()),
+    ),
+}
+outcome_segments = (
+    ("TOUCHDOWN drive {drive}", ('touchdown', 'drive')),
+    ("sack", ('sack',)),
+    ("penalty {penalty_team} {penalty_player_name} {penalty_type} {penalty_yards} yds",
+     ('penalty', 'penalty_team', 'penalty_player_name', 'penalty_type', 'penalty_yards')),
+)
+# segments of every play type, resolved once
+play_templates = {play_type: header_segments + segments + outcome_segments for play_type, segments in play_segments.items()}
+generic_template = header_segments + situation_segments + (("{play_type}", ('play_type',)),) + outcome_segments
+
+
+def count_tokens(text):
+    """ Rough token count: words and punctuation marks """
+    return len(token_pattern.findall(text))
+
+
+def encode_play(row):
+    """
+    Encodes a play as a compact line for the prompts, using the template of its play type.
+    Fields that are empty in the row are left out.
+    :param row: PlayRecord, or dictionary that describes the play
+    :return: play description
+    """
+    row = as_play_record(row)
+    # the fields as the dataset writes them, the flags are only kept when they are set
+    values = {key: display_value(value) for key, value in row.items() if value is not None and key not in flag_cols}
+    values.update((flag, True) for flag in flag_cols if row[flag])
+    values['quarter'] = quarter_names.get(values.get('qtr'), values.get('qtr'))
+    if values.get('time') == "15:00":
+        values['new_quarter'] = True
+    if values.get('down') in down_names:
+        values['down_name'] = down_names[values['down']]
+    if 'pass_length' not in values:
+        values['no_pass_length'] = True
+    values['completion'] = "complete" if 'complete_pass' in values else "incomplete"
+
+    template = play_templates.get(values.get('play_type', ''), generic_template)
+    segments = [fmt.format(**values) for fmt, fields in template if all(values.get(field) for field in fields)]
+    return "; ".join(segment for segment in segments if segment)
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import deque
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when a call cannot be admitted before its deadline. """
+
+
+class AdaptiveRateLimiter(object):
+    """
+    Token bucket whose rate adapts to throttling with additive increase, multiplicative decrease.
+
+    One limiter is shared by every model call of the Lambda container. Without max_rate the
+    calls are not limited until the model throttles one: the limiter then starts from the rate
+    of the last second of calls, cut by decrease_factor. While calls succeed the rate grows by
+    about additive_increase calls per second every second, up to max_rate if it is set (e.g.
+    the provisioned quota). Every throttle response cuts it by decrease_factor, at most once
+    per decrease_interval so that a burst of throttled in-flight calls counts once.
+    """
+
+    def __init__(self, max_rate=None, min_rate=0.5, burst=9, additive_increase=1.0, decrease_factor=0.5,
+                 decrease_interval=1.0):
+        """
+        :param max_rate: optional maximum calls per second, the limiter starts at this rate; None
+                         does not limit the calls until the first throttle
+        :param min_rate: the rate is never cut below this number of calls per second
+        :param burst: calls that may start at once after an idle period
+        :param additive_increase: calls per second added per second of successful calls
+        :param decrease_factor: factor applied to the rate on a throttle response
+        :param decrease_interval: minimum seconds between two decreases
+        """
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.rate = max_rate
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        # admission times of the last second while the calls are not limited
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.successes = 0
+        self.throttles = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, deadline=None):
+        """
+        Waits for a token.
+        :param deadline: optional time.monotonic() value by which the call has to be admitted
+        :return: seconds the call waited
+        """
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.rate is None:
+                    self._recent.append(now)
+                    while self._recent[0] < now - 1:
+                        self._recent.popleft()
+                    self.admitted += 1
+                    return 0.0
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    waited = now - start
+                    self.admitted += 1
+                    self.queue_seconds += waited
+                    self.max_queue_seconds = max(self.max_queue_seconds, waited)
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+                if deadline is not None and now + wait > deadline:
+                    self.rejected += 1
+                    raise DeadlineExceeded(f"no model call slot before the deadline, rate {self.rate:.2f}/s")
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.successes += 1
+            if self.rate is None:
+                return
+            self.rate = self.rate + self.additive_increase / self.rate
+            if self.max_rate is not None:
+                self.rate = min(self.max_rate, self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.decrease_interval:
+                self._last_decrease = now
+                if self.rate is None:
+                    # the first throttle, the rate of the last second of calls was too high
+                    self.rate = float(len(self._recent)) or self.min_rate
+                    self._recent.clear()
+                    self._refill(now)
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                self._tokens = min(self._tokens, 0.0)
+
+    def stats(self):
+        with self._lock:
+            responses = self.successes + self.throttles
+            return {
+                "rate": round(self.rate, 2) if self.rate is not None else None,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "throttles": self.throttles,
+                "throttle_rate": round(self.throttles / responses, 4) if responses else 0,
+                "queue_ms_avg": round(self.queue_seconds / self.admitted * 1000, 1) if self.admitted else 0,
+                "queue_ms_max": round(self.max_queue_seconds * 1000, 1),
+            }
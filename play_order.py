@@ -0,0 +1,133 @@
+import time
+from collections import OrderedDict
+
+
+class PlayReorderBuffer(object):
+    """
+    Releases the records of one game in the order of their play_seq.
+
+    The plays of a game share a partition key, so they stay in order on their shard, but the
+    lambda function processes several records of a batch at a time, publishes commentaries
+    early and retries failed batches. A play that arrives before the plays preceding it is
+    held until the gap is filled, or until it waited max_wait seconds or more than max_held
+    plays are held, at which point the missing plays are skipped. Plays arriving after
+    their turn (duplicates or plays that were skipped) are released right away.
+    """
+
+    def __init__(self, max_wait=2.0, max_held=32, next_seq=0):
+        """
+        :param max_wait: seconds a play is held for the plays preceding it
+        :param max_held: maximum number of held plays
+        :param next_seq: play_seq of the first play expected
+        """
+        self.max_wait = max_wait
+        self.max_held = max_held
+        self.next_seq = next_seq
+        self.held = {}
+        self.skipped = 0
+        self.late = 0
+
+    def add(self, play_seq, record, now=None):
+        """
+        :param play_seq: sequence number of the play in its game
+        :param record: record of the play
+        :param now: current time.monotonic(), for testing
+        :return: records that can be delivered, in order
+        """
+        now = time.monotonic() if now is None else now
+        if play_seq < self.next_seq:
+            self.late += 1
+            return [record]
+        self.held.setdefault(play_seq, (now, []))[1].append(record)
+        return self.release(now)
+
+    def release(self, now=None):
+        """
+        :param now: current time.monotonic(), for testing
+        :return: held records whose turn has come or that waited long enough, in order
+        """
+        now = time.monotonic() if now is None else now
+        released = []
+        while self.held:
+            if self.next_seq not in self.held:
+                oldest = min(self.held)
+                if len(self.held) <= self.max_held and now - self.held[oldest][0] < self.max_wait:
+                    break
+                # give up on the missing plays
+                self.skipped += oldest - self.next_seq
+                self.next_seq = oldest
+            released.extend(self.held.pop(self.next_seq)[1])
+            self.next_seq += 1
+        return released
+
+    def next_due(self, now=None):
+        """
+        :param now: current time.monotonic(), for testing
+        :return: seconds until a held play is released by timeout, or None if nothing is held
+        """
+        if not self.held:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, min(arrived for arrived, _ in self.held.values()) + self.max_wait - now)
+
+
+class SessionPlayOrder(object):
+    """
+    Reorder buffers of the games a session receives plays of, keyed by game_id. Only the
+    max_games most recently started games are tracked.
+    """
+
+    def __init__(self, max_wait=2.0, max_held=32, max_games=4):
+        """
+        :param max_wait: seconds a play is held for the plays preceding it
+        :param max_held: maximum number of held plays per game
+        :param max_games: number of games tracked
+        """
+        self.max_wait = max_wait
+        self.max_held = max_held
+        self.max_games = max_games
+        self.games = OrderedDict()
+        self.pending = []
+
+    def add(self, json_record, now=None):
+        """
+        :param json_record: record from the commentary stream
+        :param now: current time.monotonic(), for testing
+        :return: records that can be delivered, in order; records without game_id or play_seq pass through
+        """
+        game_id, play_seq = json_record.get('game_id'), json_record.get('play_seq')
+        if game_id is None or play_seq is None:
+            return [json_record]
+        if game_id not in self.games:
+            self.games[game_id] = PlayReorderBuffer(self.max_wait, self.max_held)
+            while len(self.games) > self.max_games:
+                _, evicted = self.games.popitem(last=False)
+                # the plays held for an old game are still shown
+                self.pending.extend(evicted.release(float("inf")))
+        return self.games[game_id].add(int(play_seq), json_record, now)
+
+    def release(self, now=None):
+        """
+        :param now: current time.monotonic(), for testing
+        :return: records of every game that waited long enough
+        """
+        released, self.pending = self.pending, []
+        for buffer in self.games.values():
+            released.extend(buffer.release(now))
+        return released
+
+    def next_due(self, now=None):
+        """ :return: seconds until held plays are released by timeout, or None if nothing is held """
+        if self.pending:
+            return 0.0
+        dues = [due for due in (buffer.next_due(now) for buffer in self.games.values()) if due is not None]
+        return min(dues) if dues else None
+
+    def stats(self):
+        """
+        :return: plays held, plays skipped, and records that arrived after their play was
+                 released, e.g. the complete record of a play following its early record
+        """
+        return {"held": sum(len(buffer.held) for buffer in self.games.values()),
+                "skipped": sum(buffer.skipped for buffer in self.games.values()),
+                "late": sum(buffer.late for buffer in self.games.values())}
@@ -0,0 +1,133 @@
+import csv
+from operator import attrgetter, itemgetter
+
+# telemetry columns of a play, in the order of the dataset, shared by the simulator, the lambda function and the UI
+cols = [ 'yrdln', 'time', 'qtr', 'total_home_score', 'total_away_score', 'play_type',
+     'posteam', 'defteam', 'down', 'yards_gained', 'drive', 'sack', 'complete_pass',
+     'penalty', 'penalty_team', 'penalty_player_name', 'penalty_yards', 'penalty_type',
+     'kick_distance', 'return_yards', 'kicker_player_name', 'kickoff_returner_player_name',
+     'pass_length', 'ydstogo','passer_player_name', 'receiver_player_name', 'rusher_player_name',
+     'solo_tackle_1_player_name', 'assist_tackle_1_player_name', 'punter_player_name',
+     'field_goal_result', 'extra_point_result', 'touchdown'
+]
+int_cols = ('qtr', 'total_home_score', 'total_away_score', 'down', 'yards_gained', 'drive', 'penalty_yards',
+            'kick_distance', 'return_yards', 'ydstogo')
+flag_cols = ('sack', 'complete_pass', 'penalty', 'touchdown')
+column_set = frozenset(cols)
+empty_values = ("", "nan", "None")
+
+
+def parse_str(value):
+    """ :return: the stripped text, None if the field is empty """
+    if value is None:
+        return None
+    value = str(value).strip()
+    return None if value in empty_values else value
+
+
+def parse_int(value):
+    """ :return: the number, None if the field is empty; text that is not a number is kept """
+    if value is None or isinstance(value, int):
+        return value
+    value = parse_str(value)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return value
+
+
+def parse_flag(value):
+    """ :return: whether the flag is set, the CSV has "1" and "0" or nothing """
+    if isinstance(value, bool):
+        return value
+    return value is not None and str(value).strip() in ("1", "1.0", "True", "true")
+
+
+def display_value(value):
+    """ :return: the value as the dataset writes it, for the telemetry table of the UI """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+# parser of every column, resolved once
+column_parsers = tuple(parse_flag if col in flag_cols else parse_int if col in int_cols else parse_str
+                       for col in cols)
+get_columns = itemgetter(*cols)
+
+
+class PlayRecord(object):
+    """
+    Telemetry of one play with typed fields: numbers are int, flags are bool and empty fields None.
+
+    Rows are parsed once, by the simulator from the CSV and by the lambda function from the
+    stream record. A PlayRecord can be read like the dictionary it was built from
+    (record['play_type'], record.get(...), record.items()), to_dict returns the JSON form.
+    """
+    __slots__ = tuple(cols)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: CSV row or decoded record holding the telemetry columns, as text or typed values
+        :return: PlayRecord of the play, missing columns are None
+        """
+        try:
+            values = get_columns(data)
+        except KeyError:
+            values = [data.get(col) for col in cols]
+        record = cls.__new__(cls)
+        for setter, parser, value in zip(slot_setters, column_parsers, values):
+            setter(record, parser(value))
+        return record
+
+    def values(self):
+        return get_slots(self)
+
+    def keys(self):
+        return cols
+
+    def items(self):
+        return zip(cols, get_slots(self))
+
+    def to_dict(self):
+        return dict(zip(cols, get_slots(self)))
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in column_set else default
+
+    def __getitem__(self, key):
+        if key not in column_set:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in column_set
+
+    def __repr__(self):
+        return f"PlayRecord({self.to_dict()!r})"
+
+
+slot_setters = tuple(getattr(PlayRecord, col).__set__ for col in cols)
+get_slots = attrgetter(*cols)
+
+
+def as_play_record(row):
+    """
+    :param row: PlayRecord, or CSV row or decoded record of a play
+    :return: the play as PlayRecord
+    """
+    return row if isinstance(row, PlayRecord) else PlayRecord.from_dict(row)
+
+
+def read_plays(path):
+    """
+    :param path: CSV file of a game
+    :return: tuple of the plays as PlayRecord
+    """
+    with open(path) as csv_file:
+        return tuple(PlayRecord.from_dict(row) for row in csv.DictReader(csv_file))
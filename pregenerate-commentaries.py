@@ -0,0 +1,36 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# the commentaries are generated with the code of the lambda function
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambda"))
+
+import lambda_function
+from commentary_artifact import write_artifact
+from game_simulator import load_plays, sample_input_csv
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generates the commentaries of a known game once, for the replay mode of the UI")
+    parser.add_argument("--dataset", help="CSV file of the game", type=str, default=sample_input_csv)
+    parser.add_argument("--output", help="commentary artifact to write", type=str, default="data/commentary_artifact.jsonl")
+    parser.add_argument("--concurrency", help="plays generated at the same time, each fans out COMMENTARY_CONCURRENCY model calls",
+                        type=int, default=4)
+    args = parser.parse_args()
+
+    plays = load_plays(args.dataset)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="pregenerate") as executor:
+        # every style and language combination, in dataset order
+        commentary_objs = list(executor.map(lambda_function.get_commentaries, plays))
+    elapsed = time.time() - start
+    write_artifact(args.output, args.dataset, commentary_objs, model=lambda_function.bedrock_model_id,
+                   prompt_mode=lambda_function.commentary_prompt_mode, prompt_encoding=lambda_function.prompt_encoding)
+
+    commentaries = sum(len(play_commentary_objs) for play_commentary_objs in commentary_objs)
+    model_commentaries = sum(1 for play_commentary_objs in commentary_objs for commentary_obj in play_commentary_objs
+                             if commentary_obj.get('model_call') is not None)
+    print(f"{len(plays)} plays, {commentaries} commentaries ({model_commentaries} from the model) "
+          f"in {elapsed:.1f}s written to {args.output}", file=sys.stderr)
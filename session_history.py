@@ -0,0 +1,135 @@
+import json
+import sys
+from operator import itemgetter
+
+
+class SessionHistory(object):
+    """
+    Fixed capacity history of the plays and commentaries shown to one session.
+
+    Telemetry is kept column by column in preallocated ring buffers, so appending a play is
+    O(1) and the memory of a session stays flat however long the game runs. The display
+    frame is only built when it is read. The full game can optionally be kept in an
+    append-only JSON lines spill file.
+    """
+    __slots__ = ('columns', 'capacity', 'spill_path', 'formatter', '_get_columns', '_values', '_row_count',
+                 '_commentaries', '_commentary_count', '_frame', '_spill')
+
+    def __init__(self, columns, capacity, spill_path=None, formatter=None):
+        """
+        :param columns: telemetry columns to keep
+        :param capacity: number of plays and commentaries kept in memory
+        :param spill_path: optional file the full history is appended to
+        :param formatter: optional function applied to every value of the display frame
+        """
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.formatter = formatter
+        # projection of a row on the columns, resolved once
+        self._get_columns = itemgetter(*self.columns) if len(self.columns) > 1 else lambda row: (row[self.columns[0]],)
+        self._values = [[None] * capacity for _ in self.columns]
+        self._row_count = 0
+        self._commentaries = [None] * capacity
+        self._commentary_count = 0
+        self._frame = None
+        self._spill = None
+
+    def __len__(self):
+        return min(self._row_count, self.capacity)
+
+    def append(self, row, commentary=None):
+        """
+        Adds a play to the history.
+        :param row: telemetry of the play, a dictionary holding at least the history columns
+        :param commentary: commentary shown for the play, None if there is none
+        """
+        slot = self._row_count % self.capacity
+        try:
+            row_values = self._get_columns(row)
+        except KeyError:
+            row_values = [row.get(col) for col in self.columns]
+        for values, value in zip(self._values, row_values):
+            values[slot] = value
+        self._row_count += 1
+        if commentary is not None:
+            self._commentaries[self._commentary_count % self.capacity] = commentary
+            self._commentary_count += 1
+        self._frame = None
+        if self.spill_path is not None:
+            if self._spill is None:
+                self._spill = open(self.spill_path, 'a')
+            self._spill.write(json.dumps({'row': dict(zip(self.columns, row_values)),
+                                          'commentary': commentary}) + "\n")
+            self._spill.flush()
+
+    def commentaries(self, n=None):
+        """
+        :param n: number of the most recent commentaries to return, defaults to all kept in memory
+        :return: list of commentaries, oldest first
+        """
+        count = min(self._commentary_count, self.capacity)
+        if n is not None:
+            count = min(count, n)
+        first = self._commentary_count - count
+        return [self._commentaries[i % self.capacity] for i in range(first, self._commentary_count)]
+
+    def column(self, col):
+        """
+        :param col: column name
+        :return: the values of the column kept in memory, oldest first
+        """
+        values = self._values[self.columns.index(col)]
+        first = self._row_count - len(self)
+        return [values[i % self.capacity] for i in range(first, self._row_count)]
+
+    def frame(self):
+        """
+        :return: pandas DataFrame of the plays kept in memory, oldest first
+        """
+        if self._frame is None:
+            import pandas as pd
+            formatter = self.formatter
+            self._frame = pd.DataFrame({col: self.column(col) if formatter is None else
+                                        [formatter(value) for value in self.column(col)]
+                                        for col in self.columns}, columns=self.columns)
+        return self._frame
+
+    def rows(self):
+        """
+        :return: list of the plays kept in memory as lists of formatted values, oldest first
+        """
+        formatter = self.formatter
+        columns = [self.column(col) if formatter is None else [formatter(value) for value in self.column(col)]
+                   for col in self.columns]
+        return [list(row) for row in zip(*columns)]
+
+    @property
+    def row_count(self):
+        """ :return: number of plays appended since the history was created or cleared """
+        return self._row_count
+
+    def nbytes(self):
+        """
+        :return: approximate memory held by the history in bytes
+        """
+        total = sys.getsizeof(self._commentaries)
+        total += sum(sys.getsizeof(commentary) for commentary in self._commentaries if commentary is not None)
+        for values in self._values:
+            total += sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values if value is not None)
+        return total
+
+    def clear(self):
+        for values in self._values:
+            values[:] = [None] * self.capacity
+        self._commentaries[:] = [None] * self.capacity
+        self._row_count = 0
+        self._commentary_count = 0
+        self._frame = None
+        self.close()
+
+    def close(self):
+        """ Closes the spill file, later appends reopen it. """
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
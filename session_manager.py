@@ -0,0 +1,124 @@
+import logging
+import time
+from threading import Event, Lock, Thread
+
+
+class SessionLimitError(Exception):
+    """ Raised when a new session would exceed the maximum number of live sessions. """
+
+
+class SessionManager(object):
+    """
+    Keeps the state of the live UI sessions.
+
+    Sessions that have not been seen for idle_ttl seconds are evicted by a background reaper
+    thread, and at most max_sessions sessions are live at the same time. on_evict is called
+    with the state of every evicted session to release its resources.
+    """
+
+    def __init__(self, idle_ttl=900, max_sessions=200, reap_interval=30, on_evict=None):
+        """
+        :param idle_ttl: seconds after which a session that has not been seen is evicted
+        :param max_sessions: maximum number of live sessions
+        :param reap_interval: seconds between two checks for idle sessions
+        :param on_evict: optional callback receiving the state of an evicted session
+        """
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.reap_interval = reap_interval
+        self.on_evict = on_evict
+        self.sessions = {}
+        self.last_seen = {}
+        self.evictions = 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.reaper = None
+
+    def __contains__(self, sess_id):
+        return sess_id in self.sessions
+
+    def get(self, sess_id):
+        """
+        :param sess_id: session ID
+        :return: the state of the session, or an empty dictionary for unknown sessions
+        """
+        if sess_id in self.sessions:
+            self.touch(sess_id)
+            return self.sessions[sess_id]
+        return {}
+
+    def touch(self, sess_id):
+        """ Marks a session as active. """
+        if sess_id in self.sessions:
+            self.last_seen[sess_id] = time.time()
+
+    def add(self, sess_id, state):
+        """
+        Registers the state of a session, evicting idle sessions first if the limit is reached.
+        :param sess_id: session ID
+        :param state: session specific information
+        """
+        if sess_id not in self.sessions and len(self.sessions) >= self.max_sessions:
+            self.reap()
+            if len(self.sessions) >= self.max_sessions:
+                raise SessionLimitError(f"The maximum of {self.max_sessions} live sessions is reached")
+        with self.lock:
+            self.sessions[sess_id] = state
+            self.last_seen[sess_id] = time.time()
+
+    def evict(self, sess_id):
+        with self.lock:
+            state = self.sessions.pop(sess_id, None)
+            self.last_seen.pop(sess_id, None)
+        if state is None:
+            return
+        self.evictions += 1
+        if self.on_evict is not None:
+            try:
+                self.on_evict(state)
+            except Exception:
+                logging.exception(f"failed to release session {sess_id}")
+
+    def reap(self):
+        """ Evicts the sessions that have been idle for longer than idle_ttl. """
+        deadline = time.time() - self.idle_ttl
+        with self.lock:
+            idle = [sess_id for sess_id, last_seen in self.last_seen.items() if last_seen < deadline]
+        for sess_id in idle:
+            logging.info(f"evicting idle session {sess_id}")
+            self.evict(sess_id)
+
+    def gauges(self, session_bytes=None):
+        """
+        :param session_bytes: optional function estimating the memory held by a session state
+        :return: dictionary of the live session gauges
+        """
+        gauges = {"live_sessions": len(self.sessions), "evicted_sessions": self.evictions}
+        if session_bytes is not None:
+            sizes = [session_bytes(state) for state in list(self.sessions.values())]
+            gauges["session_bytes_total"] = sum(sizes)
+            gauges["session_bytes_max"] = max(sizes, default=0)
+            gauges["session_bytes_avg"] = sum(sizes) // len(sizes) if sizes else 0
+        return gauges
+
+    def start(self, report=None):
+        """
+        Starts the reaper thread.
+        :param report: optional function called after every reaping round, e.g. to log gauges
+        """
+        def reap_loop():
+            while not self.stopped.wait(self.reap_interval):
+                self.reap()
+                if report is not None:
+                    report()
+
+        self.reaper = Thread(target=reap_loop, name="session-reaper", daemon=True)
+        self.reaper.start()
+
+    def shutdown(self):
+        """ Stops the reaper thread and evicts every session. """
+        self.stopped.set()
+        if self.reaper is not None:
+            self.reaper.join()
+        for sess_id in list(self.sessions):
+            self.evict(sess_id)
@@ -0,0 +1,804 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from threading import Thread, Lock, Event
+import botocore.exceptions
+from commentary_artifact import CommentaryArtifact, commentary_artifact_key
+from game_simulator import SimulatorEngine, KinesisStream, kinesis_data_stream as simulator_data_stream, sample_input_csv
+from play_order import SessionPlayOrder
+from play_schema import cols, display_value
+from session_history import SessionHistory
+from session_manager import SessionManager, SessionLimitError
+from session_store import get_session_store
+from stream_backend import get_kinesis_client
+from subscriptions import get_subscription_registry
+from tracing import get_trace_recorder
+from wire_format import decode_record, peek_session
+
+max_lines = 50 # commentaries and plays shown per session
+default_language = "English"
+default_style = "NFL"
+kinesis_data_stream_key = "SPORT_DATA_LIVE_COMMENTARIES_STREAM"
+kinesis_data_stream = os.getenv(kinesis_data_stream_key, "sports-data-live-commentaries")
+max_sessions = int(os.getenv("MAX_SESSIONS", "200"))
+session_manager = SessionManager(idle_ttl=int(os.getenv("SESSION_IDLE_TTL", "900")), max_sessions=max_sessions)
+user_states = session_manager.sessions
+# simulated games of all sessions run on one event loop in this process
+simulator_engine = SimulatorEngine(KinesisStream(simulator_data_stream), max_games=int(os.getenv("MAX_SIMULATORS", "200")))
+simulator_speed = float(os.getenv("SIMULATOR_SPEED", "1")) # time compression of the simulated games
+inbox_size = 1000 # records kept for a session until the session service delivers them
+merged_plays_size = 256 # plays per session remembered to merge early, partial and complete records of a play
+history_spill_dir = os.getenv("SESSION_HISTORY_DIR") # optional directory keeping the full history of every session
+consumer_batch_size = 1000 # records read from a shard per request
+min_poll_interval = 0.2 # seconds between reads while behind, a shard serves 5 reads per second
+max_poll_interval = 2 # seconds between reads while the shard is idle
+shard_refresh_interval = 60 # seconds between checks for new shards
+reorder_max_wait = float(os.getenv("REORDER_MAX_WAIT", "2")) # seconds a play waits for the earlier plays of its game
+reorder_max_held = 32 # plays per game held back at most
+stream_consumer = None
+stream_consumer_lock = Lock()
+subscription_registry = get_subscription_registry()
+trace_recorder = get_trace_recorder() # per-stage latency of the delivered plays
+subscription_refresh_interval = 60 # seconds between refreshes of a live session's subscription
+settings_poll_interval = 0.5 # seconds between reads of the settings of a shared session store
+# pregenerated commentaries of the dataset, see pregenerate-commentaries.py. When it is set the sessions
+# replay them, without the stream, the lambda function or any model call
+commentary_artifact_path = os.getenv(commentary_artifact_key)
+commentary_artifact = CommentaryArtifact.load(commentary_artifact_path, sample_input_csv) if commentary_artifact_path else None
+
+
+class SessionInbox(object):
+    """
+    Records routed to one session that the session service has not delivered yet. Appending a
+    record calls on_append, which wakes up the session service.
+    """
+    def __init__(self, maxlen, on_append=None):
+        self.records = deque(maxlen=maxlen)
+        self.on_append = on_append
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, json_record):
+        self.records.append(json_record)
+        if self.on_append is not None:
+            self.on_append()
+
+    def popleft(self):
+        return self.records.popleft()
+
+
+class ShardReader(Thread):
+    """
+    Reads one shard of the commentary stream in large batches.
+
+    The reader polls again right away (within the 5 reads per second shard limit) while it
+    is behind the tip of the shard, and backs off up to max_poll_interval while the shard is idle.
+    Once a closed shard is read to its end, the reader sets closed and wakes up the consumer,
+    which then starts reading the child shards. A reader that fails wakes up the consumer too,
+    which replaces it with a reader resuming after its last record.
+    """
+    def __init__(self, consumer, shard_id, last_sequence_number=None, iterator_type='LATEST'):
+        """
+            :param consumer: RunnableKinesisStreamConsumer the records are dispatched to
+            :param shard_id: ID of the shard
+            :param last_sequence_number: optional sequence number to resume after
+            :param iterator_type: where to start without last_sequence_number, LATEST or TRIM_HORIZON
+        """
+        super(ShardReader, self).__init__(daemon=True)
+        self.consumer = consumer
+        self.shard_id = shard_id
+        self.stop = False
+        self.closed = False
+        self.failed = False
+        self.shard_iterator = None
+        self.last_sequence_number = last_sequence_number
+        self.iterator_type = iterator_type
+        self.poll_interval = min_poll_interval
+        self.metrics = {'reads': 0, 'records': 0, 'skipped': 0, 'undecodable': 0, 'last_batch': 0,
+                        'millis_behind_latest': None, 'poll_interval': self.poll_interval}
+
+    def get_shard_iterator(self):
+        if self.last_sequence_number:
+            response = self.consumer.get_client().get_shard_iterator(
+                    StreamName=kinesis_data_stream,
+                    ShardId=self.shard_id,
+                    ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+                    StartingSequenceNumber=self.last_sequence_number
+                )
+        else:
+            response = self.consumer.get_client().get_shard_iterator(
+                    StreamName=kinesis_data_stream,
+                    ShardId=self.shard_id,
+                    ShardIteratorType=self.iterator_type
+                )
+        return response['ShardIterator']
+
+    def read(self):
+        """
+            Reads the next batch of the shard and dispatches its records.
+            :return: the get_records response
+        """
+        if not self.shard_iterator:
+            self.shard_iterator = self.get_shard_iterator()
+        try:
+            response = self.consumer.get_client().get_records(ShardIterator=self.shard_iterator, Limit=consumer_batch_size)
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] == 'ExpiredIteratorException':
+                logging.info(f"shard iterator of {self.shard_id} expired, creating a new one")
+                self.shard_iterator = self.get_shard_iterator()
+                response = self.consumer.get_client().get_records(ShardIterator=self.shard_iterator, Limit=consumer_batch_size)
+            else:
+                raise error
+
+        self.shard_iterator = response.get('NextShardIterator')
+        records = response['Records']
+        read_at = round(time.time(), 3)
+        for record in records:
+            sess_id = peek_session(record['Data'])
+            if sess_id is not None and not self.consumer.is_registered(sess_id):
+                # the header names the session, skip the body of records nobody here watches
+                self.metrics['skipped'] += 1
+                continue
+            try:
+                json_record = decode_record(record['Data'])
+            except Exception:
+                # a malformed record must not stop the shard, the sessions after it still read it
+                logging.exception(f"skipping undecodable record {record['SequenceNumber']} of {self.shard_id}")
+                self.metrics['undecodable'] += 1
+                continue
+            if 'trace' in json_record:
+                json_record['trace']['commentary_arrival'] = record['ApproximateArrivalTimestamp'].timestamp()
+                json_record['trace']['consumer_read'] = read_at
+            self.consumer.dispatch(json_record)
+        if records:
+            self.last_sequence_number = records[-1]['SequenceNumber']
+
+        millis_behind_latest = response.get('MillisBehindLatest', 0)
+        if records and (millis_behind_latest > 0 or len(records) == consumer_batch_size):
+            self.poll_interval = min_poll_interval
+        elif records:
+            self.poll_interval = min_poll_interval * 2
+        else:
+            self.poll_interval = min(self.poll_interval * 2, max_poll_interval)
+        self.metrics['reads'] += 1
+        self.metrics['records'] += len(records)
+        self.metrics['last_batch'] = len(records)
+        self.metrics['millis_behind_latest'] = millis_behind_latest
+        self.metrics['poll_interval'] = self.poll_interval
+        logging.debug(f"read {len(records)} records from {self.shard_id}, {millis_behind_latest} ms behind latest")
+        return response
+
+    def run(self):
+        while not self.stop:
+            try:
+                self.read()
+            except botocore.exceptions.ClientError as error:
+                if error.response['Error']['Code'] != 'ProvisionedThroughputExceededException':
+                    self.fail()
+                    break
+                self.poll_interval = max_poll_interval
+            except Exception:
+                self.fail()
+                break
+            if self.shard_iterator is None:
+                logging.info(f"{self.shard_id} is closed")
+                self.closed = True
+                self.consumer.wakeup.set()
+                break
+            time.sleep(self.poll_interval)
+
+    def fail(self):
+        """
+            Ends the reader after an error and wakes up the consumer to replace it right away.
+        """
+        logging.exception(f"reader of {self.shard_id} failed, it is restarted after {self.last_sequence_number}")
+        self.failed = True
+        self.consumer.wakeup.set()
+
+
+class RunnableKinesisStreamConsumer(Thread):
+    """
+    Reads the commentary stream once for the whole process and routes every record to the
+    inbox of the session it belongs to, so the number of stream readers does not grow with
+    the number of browser sessions. Each open shard is read by its own ShardReader.
+
+    The stream is resharded by adding shards: the records of a game share a partition key
+    and stay in order on their shard. After a split or merge, a child shard is only read
+    once its parent shards are read to their end, so that order holds across resharding.
+    """
+    def __init__(self):
+        # call the parent constructor
+        super(RunnableKinesisStreamConsumer, self).__init__(daemon=True)
+        self.stopped = Event()
+        self.wakeup = Event()
+        self.inboxes = {}
+        self.readers = {}
+        self.finished = set()
+        self.lock = Lock()
+        self.client = None
+
+    def get_client(self):
+        """
+            :return: the stream client shared by the shard readers, created on first use so that
+                     boto3 is only loaded once a session starts reading the stream
+        """
+        with self.lock:
+            if self.client is None:
+                self.client = get_kinesis_client()
+            return self.client
+
+    def register(self, sess_id, on_append=None):
+        """
+            Starts routing the records of a session to its inbox.
+            :param sess_id: session ID
+            :param on_append: optional function called after a record is appended to the inbox
+            :return: inbox the session's records are appended to
+        """
+        with self.lock:
+            if sess_id not in self.inboxes:
+                self.inboxes[sess_id] = SessionInbox(inbox_size, on_append)
+            return self.inboxes[sess_id]
+
+    def unregister(self, sess_id):
+        with self.lock:
+            self.inboxes.pop(sess_id, None)
+
+    def is_registered(self, sess_id):
+        return sess_id in self.inboxes
+
+    def list_shards(self):
+        """
+            :return: shards of the stream, open and closed, as described by ListShards
+        """
+        shards = []
+        kwargs = {'StreamName': kinesis_data_stream}
+        while True:
+            response = self.get_client().list_shards(**kwargs)
+            shards.extend(response['Shards'])
+            if 'NextToken' not in response:
+                return shards
+            kwargs = {'NextToken': response['NextToken']}
+
+    def start_readers(self, first_listing):
+        """
+            Starts a reader for every shard that is ready to be read: open shards at the tip
+            of the stream when the consumer starts, later shards from their beginning once
+            their parents are finished. Readers that died resume after their last record.
+            :param first_listing: True when the consumer starts
+        """
+        shards = self.list_shards()
+        shard_ids = {shard['ShardId'] for shard in shards}
+        for shard in shards:
+            reader = self.readers.get(shard['ShardId'])
+            if (reader is not None and reader.closed) or \
+                    (first_listing and 'EndingSequenceNumber' in shard['SequenceNumberRange']):
+                # read to its end, or closed before the consumer started
+                self.finished.add(shard['ShardId'])
+        for shard in shards:
+            shard_id = shard['ShardId']
+            reader = self.readers.get(shard_id)
+            if shard_id in self.finished or (reader is not None and reader.is_alive() and not reader.failed):
+                continue
+            parents = [shard.get('ParentShardId'), shard.get('AdjacentParentShardId')]
+            if any(parent in shard_ids and parent not in self.finished for parent in parents if parent):
+                continue
+            if reader is not None:
+                # a reader that failed before its first record keeps its starting point
+                reader = ShardReader(self, shard_id, reader.last_sequence_number, reader.iterator_type)
+            else:
+                reader = ShardReader(self, shard_id, None, 'LATEST' if first_listing else 'TRIM_HORIZON')
+            reader.start()
+            self.readers[shard_id] = reader
+        # closed shards are finished and their readers done, keep the started shards only
+        for shard_id in [shard_id for shard_id in self.readers if shard_id in self.finished]:
+            self.readers.pop(shard_id)
+
+    def lag_metrics(self):
+        """
+            :return: read metrics of every shard reader, keyed by shard ID
+        """
+        return {shard_id: dict(reader.metrics) for shard_id, reader in list(self.readers.items())}
+
+    def run(self):
+        first_listing = True
+        while not self.stopped.is_set():
+            self.wakeup.clear()
+            self.start_readers(first_listing)
+            first_listing = False
+            logging.info(f"stream consumer lag: {json.dumps(self.lag_metrics())}")
+            # a closed shard wakes the consumer up to start its children
+            self.wakeup.wait(shard_refresh_interval)
+
+    def shutdown(self):
+        """
+            Stops the consumer and joins its shard readers.
+        """
+        self.stopped.set()
+        self.wakeup.set()
+        for reader in list(self.readers.values()):
+            reader.stop = True
+        for reader in list(self.readers.values()):
+            reader.join(max_poll_interval * 2)
+        self.join(max_poll_interval * 2)
+
+    def dispatch(self, json_record):
+        """
+            Appends a record to the inbox of its session, records of unknown sessions are dropped.
+            :param json_record: decoded record from the kinesis data stream
+        """
+        if 'sess_id' not in json_record:
+            return
+        inbox = self.inboxes.get(json_record['sess_id'])
+        if inbox is not None:
+            inbox.append(json_record)
+
+
+def get_stream_consumer():
+    """
+        Returns the process wide stream consumer, starting it on first use.
+    """
+    global stream_consumer
+    with stream_consumer_lock:
+        if stream_consumer is None or not stream_consumer.is_alive():
+            stream_consumer = RunnableKinesisStreamConsumer()
+            stream_consumer.start()
+        return stream_consumer
+
+
+def merge_record(json_record, matching_record, user_state):
+    """
+        Merges the records published for the same play: the lambda function may publish the
+        commentaries of a play one combination at a time (early records), stream their
+        partial text (partial records), and always publishes the complete record.
+        :param json_record: record from the kinesis data stream
+        :param matching_record: commentary of the record for the session's style and language, or None
+        :param user_state: session specific information
+        :return: True if the record shows the play for the first time and belongs in the history
+    """
+    play_id = json_record.get('play_id')
+    if play_id is None:
+        return True
+    shown_plays = user_state.setdefault('shown_plays', OrderedDict())
+    pending = user_state.setdefault('pending', OrderedDict())
+    if play_id in shown_plays:
+        return False
+    if json_record.get('partial'):
+        if matching_record is not None:
+            pending[play_id] = matching_record
+        return False
+    if json_record.get('early') and matching_record is None:
+        # the early record of another style or language
+        return False
+    shown_plays[play_id] = True
+    if len(shown_plays) > merged_plays_size:
+        shown_plays.popitem(last=False)
+    pending.pop(play_id, None)
+    return True
+
+
+def get_play_order(user_state):
+    """
+        :param user_state: session specific information
+        :return: SessionPlayOrder of the session, creating it on first use
+    """
+    if 'play_order' not in user_state:
+        user_state['play_order'] = SessionPlayOrder(reorder_max_wait, reorder_max_held)
+    return user_state['play_order']
+
+
+def sequence_record(json_record, matching_record, user_state):
+    """
+        Holds back a record that shows a play until the earlier plays of its game are shown,
+        see play_order.py. Partial records and early records of other combinations never show
+        a play and are not held.
+        :param json_record: record from the kinesis data stream
+        :param matching_record: commentary of the record for the session's style and language, or None
+        :param user_state: session specific information
+        :return: records to merge, in play order
+    """
+    if json_record.get('partial') or (json_record.get('early') and matching_record is None):
+        return [json_record]
+    return get_play_order(user_state).add(json_record)
+
+
+def deliver_record(json_record, user_state):
+    """
+        Merges a record into the session and adds its play to the history if it is new.
+        :param json_record: record from the kinesis data stream
+        :param user_state: session specific information
+    """
+    matching_record = find_commentary(json_record, user_state)
+    if not merge_record(json_record, matching_record, user_state):
+        return
+    logging.info(f"matching commentary: {matching_record}")
+    # the play may not include the session's combination if it was switched mid-play
+    get_history(user_state).append(json_record['row'], matching_record)
+    if 'trace' in json_record:
+        json_record['trace']['ui_deliver'] = round(time.time(), 3)
+        trace_recorder.record(json_record)
+
+
+def drain_inbox(user_state):
+    """
+        Applies the records routed to a session since the last call to its state.
+        :param user_state: session specific information
+    """
+    inbox = user_state.get('inbox')
+    while inbox:
+        json_record = inbox.popleft()
+        for ordered_record in sequence_record(json_record, find_commentary(json_record, user_state), user_state):
+            deliver_record(ordered_record, user_state)
+    if 'play_order' in user_state:
+        # plays whose predecessors did not arrive in time
+        for ordered_record in user_state['play_order'].release():
+            deliver_record(ordered_record, user_state)
+
+
+def get_history(user_state):
+    """
+        Returns the play and commentary history of a session, creating it on first use.
+        :param user_state: session specific information
+        :return: SessionHistory of the session
+    """
+    if 'history' not in user_state:
+        spill_path = None
+        if history_spill_dir:
+            spill_path = os.path.join(history_spill_dir, f"{user_state['sess_id']}.jsonl")
+        user_state['history'] = SessionHistory(cols, max_lines, spill_path, formatter=display_value)
+    return user_state['history']
+
+
+def render_history(user_state):
+    """
+        :param user_state: session specific information
+        :return: commentary text and telemetry rows to display for the session
+    """
+    # partial commentaries of plays still being generated follow the finished ones
+    pending = list(user_state.get('pending', {}).values())
+    if 'history' not in user_state:
+        return "\n".join(pending[-max_lines:]) or " ", []
+    history = user_state['history']
+    lines = history.commentaries(max_lines) + pending
+    return "\n".join(lines[-max_lines:]) or " ", history.rows()
+
+
+def find_commentary(json_record, user_state):
+    """
+        Finds the commentary based on user settings.
+        :param json_record: input record from kinesis data stream
+        :param user_state: session specific information
+        :return: a matching commentary record
+    """
+    commentary_records = json_record['commentary_objs']
+    if 'style' in user_state:
+        style = user_state['style']
+    else:
+        style = default_style
+
+    if 'language' in user_state:
+        language = user_state['language']
+    else:
+        language = default_language
+
+    for record in commentary_records:
+        if record['style'] == style and record['language'] == language:
+            return record['commentary']
+
+def publish_subscription(user_state):
+    """
+        Publishes the commentary style and language a session is watching, so that only
+        combinations with a subscriber are generated.
+        :param user_state: session specific information
+    """
+    if subscription_registry is None or 'sess_id' not in user_state:
+        return
+    style = user_state.get('style', default_style)
+    language = user_state.get('language', default_language)
+    subscription_registry.subscribe(user_state['sess_id'], [(style, language)])
+    user_state['subscription_refreshed'] = time.time()
+
+
+def refresh_subscription(user_state):
+    """
+        Keeps the subscription of a live session from expiring.
+        :param user_state: session specific information
+    """
+    if subscription_registry is None or 'subscription_refreshed' not in user_state:
+        return
+    if time.time() - user_state['subscription_refreshed'] > subscription_refresh_interval:
+        subscription_registry.touch(user_state['sess_id'])
+        user_state['subscription_refreshed'] = time.time()
+
+
+def open_inbox(sess_id, on_append=None):
+    """
+        :param sess_id: session ID
+        :param on_append: optional function called after a record is appended to the inbox
+        :return: inbox the session's records are appended to, routed from the stream unless the session replays
+    """
+    if commentary_artifact is not None:
+        return SessionInbox(inbox_size, on_append)
+    return get_stream_consumer().register(sess_id, on_append)
+
+
+def replay_record(record, inbox):
+    """
+        Appends the commentary record the lambda function publishes for a play to a session's
+        inbox, with the commentaries of the artifact.
+        :param record: play of a replayed game
+        :param inbox: inbox of the session
+    """
+    inbox.append({
+        'row': {col: record[col] for col in cols},
+        'commentary_objs': commentary_artifact.commentary_objs(record['play_seq']),
+        'play_id': f"{record['game_id']}-{record['play_seq']}",
+        'game_id': record['game_id'],
+        'play_seq': record['play_seq'],
+        'sess_id': record['sess_id'],
+        'trace': record['trace'],
+    })
+
+
+def start_simulator(sess_id, inbox=None):
+    """
+        Starts the game of a session, in replay mode its plays go straight to the session's inbox.
+        :param sess_id: session ID
+        :param inbox: inbox of the session, see open_inbox
+        :return: GameHandle of the game
+    """
+    if commentary_artifact is not None:
+        return simulator_engine.start_game(sess_id, sess_id=sess_id, speed=simulator_speed,
+                                           emit=lambda record: replay_record(record, inbox))
+    return simulator_engine.start_game(sess_id, sess_id=sess_id, speed=simulator_speed)
+
+
+def stop_session(user_state):
+    """
+        Stops the game of a session and the delivery of its plays.
+        :param user_state: session specific information
+    """
+    sess_id = user_state['sess_id']
+    if 'inbox' in user_state:
+        if stream_consumer is not None:
+            stream_consumer.unregister(sess_id)
+        user_state.pop('inbox')
+    if 'simulation' in user_state:
+        user_state['simulation'].stop()
+        user_state.pop('simulation')
+    if subscription_registry is not None:
+        subscription_registry.unsubscribe(sess_id)
+        user_state.pop('subscription_refreshed', None)
+
+
+def release_session(user_state):
+    """
+        Releases every resource of an evicted session.
+        :param user_state: session specific information
+    """
+    stop_session(user_state)
+    if 'history' in user_state:
+        user_state['history'].close()
+
+
+def session_bytes(user_state):
+    """
+        :param user_state: session specific information
+        :return: approximate memory held by the session's history and undelivered plays
+    """
+    size = user_state['history'].nbytes() if 'history' in user_state else 0
+    if 'inbox' in user_state:
+        size += len(user_state['inbox']) * 4096 # rough size of a commentary record
+    return size
+
+
+def log_session_gauges():
+    gauges = session_manager.gauges(session_bytes)
+    gauges['running_simulators'] = simulator_engine.running_games()
+    logging.info(f"session gauges: {json.dumps(gauges)}")
+    logging.info(f"stage latency ms: {json.dumps(trace_recorder.summary())}")
+
+
+def reset_session(user_state):
+    """
+        Stops a session and clears what it shows, the session is kept for a restart.
+        :param user_state: session specific information
+    """
+    if 'history' in user_state:
+        user_state['history'].clear()
+    user_state.pop('pending', None)
+    user_state.pop('shown_plays', None)
+    user_state.pop('play_order', None)
+    stop_session(user_state)
+
+
+class SessionService(Thread):
+    """
+    Runs the UI sessions of the process on behalf of the Gradio workers.
+
+    The workers only read and write the session store: they record start and stop requests,
+    the style and language of a session and when it was last seen, and display the view the
+    service writes back. The service applies the settings (starting and stopping games,
+    subscribing to combinations), delivers the records the stream consumer routes to the
+    sessions in play order, and writes the view of every session that changed. With a shared
+    store it runs in its own process (python session_service.py), so that any number of
+    Gradio workers can serve any session.
+    """
+    def __init__(self, store):
+        """
+            :param store: session store, see session_store.py
+        """
+        super(SessionService, self).__init__(name="session-service", daemon=True)
+        self.store = store
+        self.wakeup = Event()
+        self.stopped = Event()
+        self.applied = {}
+        self.changed = set()
+        self.changed_lock = Lock()
+        store.add_listener(self.wakeup.set)
+        session_manager.on_evict = self.release
+
+    def mark_changed(self, sess_id):
+        with self.changed_lock:
+            self.changed.add(sess_id)
+        self.wakeup.set()
+
+    def release(self, user_state):
+        """
+            Releases an evicted session and removes it from the store.
+            :param user_state: session specific information
+        """
+        release_session(user_state)
+        self.applied.pop(user_state['sess_id'], None)
+        self.store.remove(user_state['sess_id'])
+
+    def apply_settings(self):
+        """
+            Applies the settings of the sessions that changed since the last call.
+        """
+        sessions = self.store.sessions()
+        for sess_id, settings in sessions.items():
+            if settings != self.applied.get(sess_id):
+                self.apply(sess_id, settings, self.applied.get(sess_id, {}))
+        for sess_id in [sess_id for sess_id in list(self.applied) if sess_id not in sessions]:
+            # removed by a worker
+            self.applied.pop(sess_id)
+            session_manager.evict(sess_id)
+
+    def apply(self, sess_id, settings, previous):
+        """
+            :param sess_id: session ID
+            :param settings: current settings of the session in the store
+            :param previous: settings applied before, empty for a new session
+        """
+        self.applied[sess_id] = settings
+        user_state = session_manager.get(sess_id)
+        if not user_state:
+            user_state = {'sess_id': sess_id}
+            try:
+                session_manager.add(sess_id, user_state)
+            except SessionLimitError as error:
+                self.store.put_view(sess_id, str(error), [])
+                return
+        session_manager.touch(sess_id)
+        switched = False
+        for key in ('style', 'language'):
+            if key in settings and user_state.get(key) != settings[key]:
+                user_state[key] = settings[key]
+                switched = True
+        if settings.get('stop', 0) != previous.get('stop', 0):
+            reset_session(user_state)
+            self.mark_changed(sess_id)
+        if settings.get('start', 0) != previous.get('start', 0):
+            self.start_game(user_state)
+        elif switched and 'subscription_refreshed' in user_state:
+            publish_subscription(user_state)
+
+    def start_game(self, user_state):
+        """
+            Starts a game for a session unless one is running, and the delivery of its plays.
+            :param user_state: session specific information
+        """
+        sess_id = user_state['sess_id']
+        if 'inbox' not in user_state:
+            user_state['inbox'] = open_inbox(sess_id, lambda: self.mark_changed(sess_id))
+        if 'simulation' not in user_state or not user_state['simulation'].running():
+            # the game has ended or never started. Start a new one.
+            try:
+                user_state['simulation'] = start_simulator(sess_id, user_state['inbox'])
+            except RuntimeError as error:
+                self.store.put_view(sess_id, str(error), [])
+                return
+        if commentary_artifact is None:
+            publish_subscription(user_state)
+        self.mark_changed(sess_id)
+
+    def deliver(self):
+        """
+            Delivers the records of the sessions that received records or hold plays that are due,
+            and writes their views.
+        """
+        with self.changed_lock:
+            changed, self.changed = self.changed, set()
+        for sess_id, user_state in list(user_states.items()):
+            play_order = user_state.get('play_order')
+            if sess_id not in changed and (play_order is None or play_order.next_due() != 0):
+                continue
+            before = (user_state['history'].row_count if 'history' in user_state else 0,
+                      dict(user_state.get('pending', {})))
+            drain_inbox(user_state)
+            after = (user_state['history'].row_count if 'history' in user_state else 0,
+                     dict(user_state.get('pending', {})))
+            if before != after or 'inbox' not in user_state or self.store.get_view(sess_id) is None:
+                commentaries, rows = render_history(user_state)
+                self.store.put_view(sess_id, commentaries, rows)
+            refresh_subscription(user_state)
+
+    def timeout(self):
+        """ :return: seconds until the next held play is due or the shared settings are read again """
+        timeout = settings_poll_interval if self.store.shared else subscription_refresh_interval
+        for user_state in list(user_states.values()):
+            if 'play_order' in user_state:
+                due = user_state['play_order'].next_due()
+                if due is not None:
+                    timeout = min(timeout, due)
+        return timeout
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.timeout())
+            self.wakeup.clear()
+            try:
+                self.apply_settings()
+                self.deliver()
+            except Exception:
+                logging.exception("failed to update the sessions")
+
+
+session_service = None
+
+
+def start_session_service(store=None):
+    """
+        Starts the process wide session service, the reaper of idle sessions and the stream consumer.
+        :param store: session store, defaults to get_session_store()
+        :return: the SessionService
+    """
+    global session_service
+    if session_service is None:
+        session_service = SessionService(store or get_session_store())
+        session_service.start()
+        session_manager.start(report=log_session_gauges)
+    return session_service
+
+
+def shutdown():
+    """
+        Stops every session, the stream consumer and the simulators when the process exits.
+    """
+    if session_service is not None:
+        session_service.stopped.set()
+        session_service.wakeup.set()
+    session_manager.shutdown()
+    if stream_consumer is not None:
+        stream_consumer.shutdown()
+    simulator_engine.shutdown()
+    trace_recorder.close()
+
+
+if __name__ == "__main__":
+    # the session service of Gradio workers sharing SESSION_STORE, see app.py
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
+    service = start_session_service()
+    if not service.store.shared:
+        raise SystemExit("Set SESSION_STORE to the session store shared with the Gradio workers")
+    if commentary_artifact is None:
+        get_stream_consumer()
+    try:
+        service.stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown()
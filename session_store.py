@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+session_store_key = "SESSION_STORE"
+
+
+class MemorySessionStore(object):
+    """
+    State of the UI sessions shared by the Gradio handlers and the session service, see
+    session_service.py, when both run in this process.
+
+    A session has settings, written by the UI (style, language, start and stop requests, last
+    seen), and a view, written by the session service (the commentary text and the telemetry
+    rows to display, with a version that grows with every change). The UI waits for a newer
+    view instead of polling it.
+    """
+    shared = False
+
+    def __init__(self):
+        self._settings = {}
+        self._views = {}
+        self._waiters = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """ :param listener: function called without arguments after the settings of a session changed """
+        self._listeners.append(listener)
+
+    def _notify(self):
+        for listener in self._listeners:
+            listener()
+
+    def update(self, sess_id, **fields):
+        """
+        Merges fields into the settings of a session, creating the session if it is new.
+        :return: the settings of the session
+        """
+        with self._lock:
+            settings = dict(self._settings.get(sess_id, {}), **fields)
+            self._settings[sess_id] = settings
+        self._notify()
+        return settings
+
+    def increment(self, sess_id, field, **fields):
+        """
+        Increments a counter of the session settings, e.g. the number of start requests, and
+        merges fields into the settings.
+        :return: the settings of the session
+        """
+        with self._lock:
+            settings = dict(self._settings.get(sess_id, {}), **fields)
+            settings[field] = settings.get(field, 0) + 1
+            self._settings[sess_id] = settings
+        self._notify()
+        return settings
+
+    def get(self, sess_id):
+        """ :return: the settings of the session, or None for unknown sessions """
+        with self._lock:
+            settings = self._settings.get(sess_id)
+            return dict(settings) if settings is not None else None
+
+    def sessions(self):
+        """ :return: dictionary of the settings of every session, keyed by session ID """
+        with self._lock:
+            return {sess_id: dict(settings) for sess_id, settings in self._settings.items()}
+
+    def remove(self, sess_id):
+        with self._lock:
+            self._settings.pop(sess_id, None)
+            self._views.pop(sess_id, None)
+            waiters = list(self._waiters.get(sess_id, ()))
+        self._wake(waiters)
+
+    def put_view(self, sess_id, commentaries, rows):
+        """
+        :param commentaries: commentary text to display
+        :param rows: telemetry rows to display, lists of values in the order of the columns
+        :return: version of the view
+        """
+        with self._lock:
+            version = self._views.get(sess_id, (0,))[0] + 1
+            self._views[sess_id] = (version, commentaries, rows)
+            waiters = list(self._waiters.get(sess_id, ()))
+        self._wake(waiters)
+        return version
+
+    def get_view(self, sess_id):
+        """ :return: tuple of the version, commentary text and rows of the session's view, or None """
+        with self._lock:
+            return self._views.get(sess_id)
+
+    @staticmethod
+    def _wake(waiters):
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait_view(self, sess_id, version, timeout):
+        """
+        Waits until the view of a session is newer than version.
+        :param timeout: seconds to wait at most
+        :return: True if there is a newer view
+        """
+        view = self.get_view(sess_id)
+        if view is not None and view[0] > version:
+            return True
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(sess_id, set()).add(waiter)
+        try:
+            # the view may have changed before the waiter was registered
+            view = self.get_view(sess_id)
+            if view is None or view[0] <= version:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.get(sess_id, set()).discard(waiter)
+                if not self._waiters.get(sess_id, True):
+                    self._waiters.pop(sess_id)
+        view = self.get_view(sess_id)
+        return view is not None and view[0] > version
+
+
+class SqliteSessionStore(MemorySessionStore):
+    """
+    Session store in a SQLite file, shared by the Gradio workers and the session service running
+    in separate processes of the host. The methods are those of MemorySessionStore, so a networked
+    store (e.g. Redis, with a hash per session and pub/sub instead of polling) can replace it.
+    """
+    shared = True
+
+    def __init__(self, path, poll_interval=0.25):
+        """
+        :param path: SQLite database file
+        :param poll_interval: seconds between two reads of a view that is waited for
+        """
+        super(SqliteSessionStore, self).__init__()
+        self.poll_interval = poll_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS session_settings "
+                           "(sess_id TEXT PRIMARY KEY, settings TEXT NOT NULL, updated REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS session_views "
+                           "(sess_id TEXT PRIMARY KEY, version INTEGER NOT NULL, commentaries TEXT NOT NULL, "
+                           "rows TEXT NOT NULL)")
+
+    def _modify(self, sess_id, modify):
+        """ Applies modify to the settings of a session in one write transaction """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT settings FROM session_settings WHERE sess_id = ?",
+                                         (sess_id,)).fetchone()
+                settings = modify(json.loads(row[0]) if row else {})
+                self._conn.execute("INSERT OR REPLACE INTO session_settings (sess_id, settings, updated) "
+                                   "VALUES (?, ?, ?)", (sess_id, json.dumps(settings), time.time()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._notify()
+        return settings
+
+    def update(self, sess_id, **fields):
+        return self._modify(sess_id, lambda settings: dict(settings, **fields))
+
+    def increment(self, sess_id, field, **fields):
+        return self._modify(sess_id, lambda settings: dict(settings, **fields, **{field: settings.get(field, 0) + 1}))
+
+    def get(self, sess_id):
+        with self._lock:
+            row = self._conn.execute("SELECT settings FROM session_settings WHERE sess_id = ?", (sess_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def sessions(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT sess_id, settings FROM session_settings").fetchall()
+        return {sess_id: json.loads(settings) for sess_id, settings in rows}
+
+    def remove(self, sess_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_settings WHERE sess_id = ?", (sess_id,))
+            self._conn.execute("DELETE FROM session_views WHERE sess_id = ?", (sess_id,))
+
+    def put_view(self, sess_id, commentaries, rows):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT version FROM session_views WHERE sess_id = ?",
+                                         (sess_id,)).fetchone()
+                version = (row[0] if row else 0) + 1
+                self._conn.execute("INSERT OR REPLACE INTO session_views (sess_id, version, commentaries, rows) "
+                                   "VALUES (?, ?, ?, ?)", (sess_id, version, commentaries, json.dumps(rows)))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return version
+
+    def get_view(self, sess_id):
+        with self._lock:
+            row = self._conn.execute("SELECT version, commentaries, rows FROM session_views WHERE sess_id = ?",
+                                     (sess_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def view_version(self, sess_id):
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM session_views WHERE sess_id = ?", (sess_id,)).fetchone()
+        return row[0] if row else 0
+
+    async def wait_view(self, sess_id, version, timeout):
+        deadline = time.monotonic() + timeout
+        while self.view_version(sess_id) <= version:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(self.poll_interval, remaining))
+        return True
+
+
+def get_session_store():
+    """
+    :return: a SqliteSessionStore at SESSION_STORE if it is set, shared by the processes of the
+             host, or else a MemorySessionStore
+    """
+    path = os.getenv(session_store_key)
+    if not path:
+        return MemorySessionStore()
+    return SqliteSessionStore(path)
@@ -0,0 +1,375 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+try:
+    from botocore.exceptions import BotoCoreError, ClientError
+    # exceptions of a failed PutRecords request
+    put_records_errors = (BotoCoreError, ClientError)
+except ImportError:
+    # the local stream backend runs without botocore, LocalKinesisClient raises none of them
+    put_records_errors = ()
+
+stream_backend_key = "STREAM_BACKEND"
+local_stream_path_key = "LOCAL_STREAM_PATH"
+local_stream_shards_key = "LOCAL_STREAM_SHARDS"
+# attempts for sending a record before giving up on it
+put_records_max_attempts = int(os.getenv("PUT_RECORDS_MAX_ATTEMPTS", "4"))
+# PutRecords limits, see https://docs.aws.amazon.com/kinesis/latest/APIReference/API_PutRecords.html
+put_records_max_entries = 500
+put_records_max_bytes = 5 * 1024 * 1024
+max_hash_key = 2 ** 128 - 1
+local_clients = {}
+local_clients_lock = threading.Lock()
+
+
+class LocalKinesisClient(object):
+    """
+    Local stand-in for the boto3 Kinesis client.
+
+    It implements the subset of the Kinesis API used by the simulator, the lambda function
+    and the UI on top of a SQLite log, with shards, sequence numbers and shard iterators.
+    Partition keys are hashed onto shards the way Kinesis does. update_shard_count closes
+    the open shards and creates child shards that record their parents, so consumers can
+    finish a parent before reading its children. Sequence numbers increase across the
+    whole stream, so a child's records come after its parents'. Use ":memory:" to keep the
+    log in the current process, or a file to share it between processes.
+    """
+
+    def __init__(self, path=":memory:", shard_count=1):
+        """
+        :param path: SQLite database file, or ":memory:"
+        :param shard_count: number of shards of streams created on first use
+        """
+        self.shard_count = shard_count
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS streams (name TEXT PRIMARY KEY, shard_count INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS records (stream TEXT NOT NULL, shard INTEGER NOT NULL, "
+                           "seq INTEGER NOT NULL, partition_key TEXT NOT NULL, data BLOB NOT NULL, arrival REAL NOT NULL, "
+                           "PRIMARY KEY (stream, shard, seq))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS shards (stream TEXT NOT NULL, shard INTEGER NOT NULL, "
+                           "starting_hash TEXT NOT NULL, ending_hash TEXT NOT NULL, parent INTEGER, "
+                           "adjacent_parent INTEGER, ending_seq INTEGER, PRIMARY KEY (stream, shard))")
+
+    def create_stream(self, StreamName, ShardCount=None):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO streams (name, shard_count) VALUES (?, ?)",
+                               (StreamName, ShardCount or self.shard_count))
+
+    def _shard_rows(self, stream):
+        """ :return: (shard, starting_hash, ending_hash, parent, adjacent_parent, ending_seq) of every shard """
+        rows = self._conn.execute("SELECT shard, starting_hash, ending_hash, parent, adjacent_parent, ending_seq "
+                                  "FROM shards WHERE stream = ? ORDER BY shard", (stream,)).fetchall()
+        if rows:
+            return [(shard, int(start), int(end), parent, adjacent, ending) for shard, start, end, parent, adjacent, ending in rows]
+        row = self._conn.execute("SELECT shard_count FROM streams WHERE name = ?", (stream,)).fetchone()
+        if row is None:
+            self._conn.execute("INSERT OR IGNORE INTO streams (name, shard_count) VALUES (?, ?)",
+                               (stream, self.shard_count))
+        shard_count = row[0] if row else self.shard_count
+        for shard in range(shard_count):
+            self._insert_shard(stream, shard, shard, shard_count)
+        return self._shard_rows(stream)
+
+    def _insert_shard(self, stream, shard, position, shard_count, parents=()):
+        """ Creates shard number shard covering the position-th of shard_count equal hash key ranges """
+        parents = list(parents) + [None, None]
+        self._conn.execute("INSERT OR IGNORE INTO shards (stream, shard, starting_hash, ending_hash, parent, "
+                           "adjacent_parent) VALUES (?, ?, ?, ?, ?, ?)",
+                           (stream, shard, str((max_hash_key + 1) * position // shard_count),
+                            str((max_hash_key + 1) * (position + 1) // shard_count - 1), parents[0], parents[1]))
+
+    @staticmethod
+    def shard_id(shard):
+        return f"shardId-{shard:012d}"
+
+    @staticmethod
+    def _shard_index(shard_id):
+        return int(shard_id.split("-")[-1])
+
+    def _shards(self, stream):
+        shards = []
+        for shard, start, end, parent, adjacent_parent, ending_seq in self._shard_rows(stream):
+            description = {
+                'ShardId': self.shard_id(shard),
+                'HashKeyRange': {'StartingHashKey': str(start), 'EndingHashKey': str(end)},
+                'SequenceNumberRange': {'StartingSequenceNumber': "0"},
+            }
+            if parent is not None:
+                description['ParentShardId'] = self.shard_id(parent)
+            if adjacent_parent is not None:
+                description['AdjacentParentShardId'] = self.shard_id(adjacent_parent)
+            if ending_seq is not None:
+                description['SequenceNumberRange']['EndingSequenceNumber'] = str(ending_seq)
+            shards.append(description)
+        return shards
+
+    def _last_seq(self, stream):
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM records WHERE stream = ?", (stream,)).fetchone()[0]
+
+    def update_shard_count(self, StreamName, TargetShardCount, ScalingType='UNIFORM_SCALING', **kwargs):
+        """
+        Closes the open shards and splits or merges them into TargetShardCount shards of equal
+        hash key ranges. Like a single Kinesis split or merge, every child has at most two
+        parents, so the count can only be doubled or halved at a time.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._shard_rows(StreamName)
+                open_shards = [row for row in rows if row[5] is None]
+                current = len(open_shards)
+                if TargetShardCount not in (current, current * 2) and TargetShardCount * 2 != current:
+                    raise ValueError(f"The local stream backend can only double or halve the {current} open shards")
+                if TargetShardCount != current:
+                    self._conn.execute("UPDATE shards SET ending_seq = ? WHERE stream = ? AND ending_seq IS NULL",
+                                       (self._last_seq(StreamName), StreamName))
+                    next_shard = rows[-1][0] + 1
+                    for position in range(TargetShardCount):
+                        start = (max_hash_key + 1) * position // TargetShardCount
+                        end = (max_hash_key + 1) * (position + 1) // TargetShardCount - 1
+                        parents = [shard for shard, parent_start, parent_end, _, _, _ in open_shards
+                                   if parent_start <= end and start <= parent_end]
+                        self._insert_shard(StreamName, next_shard + position, position, TargetShardCount, parents)
+                    self._conn.execute("UPDATE streams SET shard_count = ? WHERE name = ?", (TargetShardCount, StreamName))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {'StreamName': StreamName, 'CurrentShardCount': current, 'TargetShardCount': TargetShardCount}
+
+    def _append(self, stream, entries):
+        """ Appends (data, partition_key) entries in one transaction and returns their (shard, seq). """
+        results = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                open_shards = [row[:3] for row in self._shard_rows(stream) if row[5] is None]
+                seq = self._last_seq(stream)
+                now = time.time()
+                for data, partition_key in entries:
+                    if isinstance(data, str):
+                        data = data.encode('utf-8')
+                    hash_key = int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+                    shard = next(shard for shard, start, end in open_shards if start <= hash_key <= end)
+                    seq += 1
+                    self._conn.execute("INSERT INTO records (stream, shard, seq, partition_key, data, arrival) "
+                                       "VALUES (?, ?, ?, ?, ?, ?)", (stream, shard, seq, partition_key, data, now))
+                    results.append((shard, seq))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return results
+
+    def put_record(self, StreamName, Data, PartitionKey, **kwargs):
+        shard, seq = self._append(StreamName, [(Data, PartitionKey)])[0]
+        return {'ShardId': self.shard_id(shard), 'SequenceNumber': str(seq)}
+
+    def put_records(self, StreamName, Records, **kwargs):
+        results = self._append(StreamName, [(record['Data'], record['PartitionKey']) for record in Records])
+        return {'FailedRecordCount': 0,
+                'Records': [{'ShardId': self.shard_id(shard), 'SequenceNumber': str(seq)} for shard, seq in results]}
+
+    def list_shards(self, StreamName=None, NextToken=None, **kwargs):
+        with self._lock:
+            return {'Shards': self._shards(StreamName)}
+
+    def describe_stream(self, StreamName, **kwargs):
+        with self._lock:
+            shards = self._shards(StreamName)
+        return {'StreamDescription': {'StreamName': StreamName, 'StreamStatus': 'ACTIVE',
+                                      'Shards': shards, 'HasMoreShards': False}}
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType, StartingSequenceNumber=None,
+                           Timestamp=None, **kwargs):
+        shard = self._shard_index(ShardId)
+        with self._lock:
+            if ShardIteratorType == 'TRIM_HORIZON':
+                after = 0
+            elif ShardIteratorType == 'LATEST':
+                after = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM records WHERE stream = ? AND shard = ?",
+                                           (StreamName, shard)).fetchone()[0]
+            elif ShardIteratorType == 'AT_SEQUENCE_NUMBER':
+                after = int(StartingSequenceNumber) - 1
+            elif ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+                after = int(StartingSequenceNumber)
+            elif ShardIteratorType == 'AT_TIMESTAMP':
+                if hasattr(Timestamp, 'timestamp'):
+                    Timestamp = Timestamp.timestamp()
+                after = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM records WHERE stream = ? AND shard = ? "
+                                           "AND arrival < ?", (StreamName, shard, Timestamp)).fetchone()[0]
+            else:
+                raise ValueError(f"Unsupported shard iterator type: {ShardIteratorType}")
+        return {'ShardIterator': json.dumps([StreamName, shard, after])}
+
+    def get_records(self, ShardIterator, Limit=10000, **kwargs):
+        stream, shard, after = json.loads(ShardIterator)
+        with self._lock:
+            closed = self._conn.execute("SELECT ending_seq FROM shards WHERE stream = ? AND shard = ?",
+                                        (stream, shard)).fetchone()
+            rows = self._conn.execute("SELECT seq, partition_key, data, arrival FROM records "
+                                      "WHERE stream = ? AND shard = ? AND seq > ? ORDER BY seq LIMIT ?",
+                                      (stream, shard, after, Limit)).fetchall()
+            latest = self._conn.execute("SELECT MAX(arrival) FROM records WHERE stream = ? AND shard = ?",
+                                        (stream, shard)).fetchone()[0]
+        records = [{'SequenceNumber': str(seq), 'PartitionKey': partition_key, 'Data': bytes(data),
+                    'ApproximateArrivalTimestamp': datetime.fromtimestamp(arrival, timezone.utc)}
+                   for seq, partition_key, data, arrival in rows]
+        if rows:
+            after = rows[-1][0]
+            millis_behind_latest = int((latest - rows[-1][3]) * 1000)
+        else:
+            millis_behind_latest = 0
+        if not rows and closed is not None and closed[0] is not None:
+            # a closed shard has been read to its end, its children hold the later records
+            return {'Records': [], 'NextShardIterator': None, 'MillisBehindLatest': 0}
+        return {'Records': records, 'NextShardIterator': json.dumps([stream, shard, after]),
+                'MillisBehindLatest': millis_behind_latest}
+
+
+def get_kinesis_client():
+    """
+    Returns the client of the configured stream backend.
+
+    STREAM_BACKEND=local selects LocalKinesisClient, backed by LOCAL_STREAM_PATH (default
+    ":memory:") with LOCAL_STREAM_SHARDS shards per stream; one client is shared per path.
+    Otherwise a boto3 Kinesis client is returned.
+    """
+    if os.getenv(stream_backend_key, "kinesis") == "local":
+        path = os.getenv(local_stream_path_key, ":memory:")
+        with local_clients_lock:
+            if path not in local_clients:
+                local_clients[path] = LocalKinesisClient(path, int(os.getenv(local_stream_shards_key, "1")))
+            return local_clients[path]
+    import boto3
+    return boto3.client('kinesis')
+
+
+def default_partition_key(data):
+    """
+    Partition key of a record sent without one. The plays of a game, or else of a session, share
+    their key, so Kinesis keeps them in order on one shard while the games spread over the shards.
+    :param data: record to send
+    :return: the record's game_id or sess_id, or a random key for other records
+    """
+    if isinstance(data, dict):
+        for key in ('game_id', 'sess_id'):
+            if data.get(key):
+                return str(data[key])
+    return str(uuid.uuid4())
+
+
+def encode_json(data):
+    return json.dumps(data).encode('utf-8')
+
+
+class KinesisStream(object):
+
+    def __init__(self, stream, encode=None):
+        """
+        :param stream: name of the stream
+        :param encode: function encoding a record to bytes, defaults to JSON; see wire_format.py
+        """
+        self.stream = stream
+        self.client = None
+        self.encode = encode or encode_json
+        self.sent_bytes = 0
+        self.failed_requests = 0
+
+    def _connected_client(self):
+        """ Connect to Kinesis Streams, reusing the client for every record """
+        if self.client is None:
+            self.client = get_kinesis_client()
+        return self.client
+
+    def send_stream(self, data, partition_key=None):
+        """
+        data: python dict containing your data.
+        partition_key:  set it to some fixed value if you want processing order
+                        to be preserved when writing successive records.
+
+                        If your kinesis stream has multiple shards, AWS hashes your
+                        partition key to decide which shard to send this record to.
+
+                        Defaults to the game or session of the record, see default_partition_key.
+        """
+
+        if partition_key == None:
+            partition_key = default_partition_key(data)
+
+        client = self._connected_client()
+        encoded = self.encode(data)
+        self.sent_bytes += len(encoded)
+        return client.put_record(
+            StreamName=self.stream,
+            Data=encoded,
+            PartitionKey=partition_key
+        )
+
+    def send_stream_batch(self, items):
+        """
+        Sends several records with as few PutRecords calls as the API limits allow.
+
+        Entries rejected by Kinesis (e.g. ProvisionedThroughputExceededException) are retried
+        on their own with jittered exponential backoff, up to PUT_RECORDS_MAX_ATTEMPTS. A request
+        that fails as a whole (throttled, network error, too large) fails all of its entries,
+        they are retried the same way.
+
+        :param items: list of (data, partition_key) tuples, see send_stream
+        :return: indexes into items of the records that could not be sent
+        """
+        entries = []
+        for data, partition_key in items:
+            if partition_key == None:
+                partition_key = default_partition_key(data)
+            entries.append({'Data': self.encode(data), 'PartitionKey': partition_key})
+        self.sent_bytes += sum(len(entry['Data']) for entry in entries)
+
+        pending = list(range(len(entries)))
+        for attempt in range(put_records_max_attempts):
+            if attempt > 0:
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+            failed = []
+            for chunk in self._chunks(pending, entries):
+                try:
+                    failed.extend(self._put_records(chunk, entries))
+                except put_records_errors as error:
+                    self.failed_requests += 1
+                    logging.warning(f"PutRecords of {len(chunk)} records to {self.stream} failed: {error}")
+                    failed.extend(chunk)
+            pending = failed
+            if not pending:
+                break
+        return pending
+
+    @staticmethod
+    def _chunks(indexes, entries):
+        """ Splits the entries into PutRecords requests of at most 500 records and 5 MB """
+        chunk, chunk_bytes = [], 0
+        for index in indexes:
+            entry = entries[index]
+            entry_bytes = len(entry['Data']) + len(entry['PartitionKey'].encode('utf-8'))
+            if chunk and (len(chunk) == put_records_max_entries or chunk_bytes + entry_bytes > put_records_max_bytes):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(index)
+            chunk_bytes += entry_bytes
+        if chunk:
+            yield chunk
+
+    def _put_records(self, chunk, entries):
+        """ Sends one PutRecords request and returns the indexes of the rejected entries """
+        client = self._connected_client()
+        response = client.put_records(StreamName=self.stream, Records=[entries[index] for index in chunk])
+        if response.get('FailedRecordCount', 0) == 0:
+            return []
+        return [index for index, result in zip(chunk, response['Records']) if 'ErrorCode' in result]
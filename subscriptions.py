@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import threading
+import time
+
+subscription_store_key = "SUBSCRIPTION_STORE"
+subscription_ttl_key = "SUBSCRIPTION_TTL"
+
+
+class SubscriptionRegistry(object):
+    """
+    Registry of the commentary style and language combinations live sessions are watching.
+
+    The UI publishes the combination of every active session, the Lambda function only
+    generates the combinations with at least one subscriber. This implementation keeps the
+    registry in a local SQLite file; a shared store (e.g. DynamoDB) can replace it by
+    implementing subscribe, unsubscribe, touch and combinations.
+    """
+
+    def __init__(self, path, ttl=3600):
+        """
+        :param path: SQLite database file
+        :param ttl: seconds after which a subscription that has not been refreshed is ignored
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS subscriptions "
+                           "(sess_id TEXT NOT NULL, style TEXT NOT NULL, language TEXT NOT NULL, updated REAL NOT NULL, "
+                           "PRIMARY KEY (sess_id, style, language))")
+        self._conn.commit()
+
+    def subscribe(self, sess_id, combinations):
+        """
+        Replaces the combinations a session is subscribed to.
+        :param sess_id: session ID
+        :param combinations: iterable of (style, language) tuples
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM subscriptions WHERE sess_id = ?", (sess_id,))
+            self._conn.executemany("INSERT INTO subscriptions (sess_id, style, language, updated) VALUES (?, ?, ?, ?)",
+                                   [(sess_id, style, language, now) for style, language in combinations])
+            self._conn.commit()
+
+    def unsubscribe(self, sess_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM subscriptions WHERE sess_id = ?", (sess_id,))
+            self._conn.commit()
+
+    def touch(self, sess_id):
+        """ Marks the subscriptions of a session as still active. """
+        with self._lock:
+            self._conn.execute("UPDATE subscriptions SET updated = ? WHERE sess_id = ?", (time.time(), sess_id))
+            self._conn.commit()
+
+    def combinations(self, sess_id=None):
+        """
+        :param sess_id: optional session ID to restrict the lookup to
+        :return: set of the (style, language) tuples with at least one active subscriber
+        """
+        query = "SELECT DISTINCT style, language FROM subscriptions WHERE updated >= ?"
+        params = [time.time() - self.ttl]
+        if sess_id is not None:
+            query += " AND sess_id = ?"
+            params.append(sess_id)
+        with self._lock:
+            return {(style, language) for style, language in self._conn.execute(query, params)}
+
+
+def get_subscription_registry():
+    """
+    :return: the registry configured by SUBSCRIPTION_STORE, or None if demand-driven generation is disabled
+    """
+    path = os.getenv(subscription_store_key)
+    if not path:
+        return None
+    return SubscriptionRegistry(path, ttl=float(os.getenv(subscription_ttl_key, "3600")))
@@ -0,0 +1,225 @@
+import argparse
+import base64
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sample_input_csv = os.path.join(root_dir, "data", "simulated_game.csv")
+
+
+def load_rows():
+    with open(sample_input_csv) as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def summarize(durations):
+    """
+    :param durations: durations in seconds
+    :return: dictionary of the p50, p95 and max in milliseconds
+    """
+    durations = sorted(durations)
+    return {'p50_ms': round(durations[len(durations) // 2] * 1000, 3),
+            'p95_ms': round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 3),
+            'max_ms': round(durations[-1] * 1000, 3)}
+
+
+def bench_generate_prompts(lambda_function, rows, repeat):
+    """ Prompt building for every play of the dataset """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row in rows:
+            lambda_function.generate_prompts(lambda_function.get_row_data(row))
+        durations.append(time.perf_counter() - start)
+    best = min(durations)
+    return {'plays': len(rows), 'repeat': repeat, 'best_s': round(best, 4),
+            'us_per_play': round(best / len(rows) * 1e6, 2), 'plays_per_s': round(len(rows) / best, 1)}
+
+
+def bench_get_commentaries(lambda_function, rows, levels, plays):
+    """ Plays per second of get_commentaries at several model call concurrency levels """
+    results = {}
+    for concurrency in levels:
+        durations, failed = [], 0
+        start = time.perf_counter()
+        for row in rows[:plays]:
+            play_start = time.perf_counter()
+            try:
+                lambda_function.get_commentaries(lambda_function.get_row_data(row), concurrency=concurrency)
+            except Exception:
+                failed += 1
+            durations.append(time.perf_counter() - play_start)
+        elapsed = time.perf_counter() - start
+        results[str(concurrency)] = {'plays': len(durations), 'failed': failed,
+                                     'plays_per_s': round(len(durations) / elapsed, 2), **summarize(durations),
+                                     'model_limiter': lambda_function.model_rate_limiter.stats()}
+    return results
+
+
+def kinesis_event(rows, first_sequence_number):
+    records = []
+    for offset, row in enumerate(rows):
+        data = dict(row, sess_id=f"bench-{offset % 10}")
+        records.append({'eventSource': 'aws:kinesis', 'kinesis': {
+            'partitionKey': data['sess_id'],
+            'sequenceNumber': str(first_sequence_number + offset),
+            'data': base64.b64encode(json.dumps(data).encode('utf-8')).decode('utf-8'),
+            'approximateArrivalTimestamp': time.time()}})
+    return {'Records': records}
+
+
+def bench_lambda_handler(lambda_function, rows, batch_sizes):
+    """ lambda_handler with Kinesis batches of several sizes, publishing to the local stream backend """
+    results = {}
+    for batch_size in batch_sizes:
+        batch = [rows[index % len(rows)] for index in range(batch_size)]
+        event = kinesis_event(batch, 1)
+        start = time.perf_counter()
+        # the handler prints every payload and commentary
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = lambda_function.lambda_handler(event, None)
+        elapsed = time.perf_counter() - start
+        results[str(batch_size)] = {'records': batch_size, 'seconds': round(elapsed, 3),
+                                    'records_per_s': round(batch_size / elapsed, 2),
+                                    'failed': len(response['batchItemFailures'])}
+    return results
+
+
+def bench_ui(service, lambda_function, rows, session_counts, plays):
+    """
+    Cost in the session service of delivering a play to every session: routing the record to
+    the session inbox, find_commentary, the history append and rendering the session's view.
+    """
+    # the combinations the lambda function publishes, the sessions watch all of them
+    combinations = [(style, language) for style in lambda_function.styles for language in lambda_function.languages]
+    commentary_objs = [{'commentary': f"commentary {style} {language}", 'style': style, 'language': language}
+                       for style, language in combinations]
+    results = {}
+    for session_count in session_counts:
+        sessions = [f"bench-ui-{index}" for index in range(session_count)]
+        for index, sess_id in enumerate(sessions):
+            style, language = combinations[index % len(combinations)]
+            service.session_manager.add(sess_id, {'sess_id': sess_id, 'style': style, 'language': language,
+                                                  'inbox': service.SessionInbox(service.inbox_size)})
+        durations = []
+        for row in rows[:plays]:
+            json_record = {'row': lambda_function.get_row_data(row).to_dict(), 'commentary_objs': commentary_objs}
+            start = time.perf_counter()
+            for sess_id in sessions:
+                user_state = service.user_states[sess_id]
+                user_state['inbox'].append(dict(json_record, sess_id=sess_id))
+                service.drain_inbox(user_state)
+                service.render_history(user_state)
+            durations.append(time.perf_counter() - start)
+        for sess_id in sessions:
+            # the inbox is not registered with the stream consumer
+            service.user_states[sess_id].pop('inbox')
+            service.session_manager.evict(sess_id)
+        per_session = [duration / session_count for duration in durations]
+        results[str(session_count)] = {'plays': len(durations), 'play_ms': round(statistics.mean(durations) * 1000, 3),
+                                       'us_per_session': round(statistics.mean(per_session) * 1e6, 2),
+                                       **summarize(durations)}
+    return results
+
+
+def flatten(results, prefix=""):
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(results, baseline_path):
+    """ Prints the relative change of every metric against a previous result file """
+    with open(baseline_path) as baseline_file:
+        baseline = flatten(json.load(baseline_file)['results'])
+    for key, value in flatten(results).items():
+        if key in baseline and baseline[key]:
+            print(f"{key:<60}{baseline[key]:>14}{value:>14}{(value - baseline[key]) / baseline[key]:>+10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the prompt building, generation fan-out, lambda "
+                                                 "handler and UI state handling without network access")
+    parser.add_argument("--latency", help="seconds each fake model call takes", type=float, default=0.05)
+    parser.add_argument("--jitter", help="maximum seconds randomly added to each model call", type=float, default=0.0)
+    parser.add_argument("--throttle_rate", help="share of the model calls that are throttled", type=float, default=0.0)
+    parser.add_argument("--rate_limit", help="model calls per second accepted before the fake model throttles",
+                        type=float)
+    parser.add_argument("--model_rate_max", help="MODEL_RATE_MAX of the lambda function, unset does not cap the model calls",
+                        type=float)
+    parser.add_argument("--seed", help="seed of the fake model jitter and throttling", default="42")
+    parser.add_argument("--plays", help="plays per get_commentaries and UI measurement", type=int, default=20)
+    parser.add_argument("--concurrency", help="model call concurrency levels", type=int, nargs="+", default=[1, 3, 9])
+    parser.add_argument("--batch_sizes", help="lambda batch sizes", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--sessions", help="UI session counts", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--only", help="run only these benchmarks", nargs="+",
+                        choices=["generate_prompts", "get_commentaries", "lambda_handler", "ui"])
+    parser.add_argument("--output", help="file the JSON results are written to, defaults to stdout")
+    parser.add_argument("--baseline", help="previous result file to compare with")
+    args = parser.parse_args()
+
+    # everything runs in this process against the fake model and the in-memory stream backend
+    os.environ.update({"FAKE_BEDROCK_LATENCY": str(args.latency), "FAKE_BEDROCK_JITTER": str(args.jitter),
+                       "FAKE_BEDROCK_THROTTLE_RATE": str(args.throttle_rate), "FAKE_BEDROCK_SEED": args.seed,
+                       "STREAM_BACKEND": "local", "LOCAL_STREAM_PATH": ":memory:"})
+    if args.model_rate_max is not None:
+        os.environ["MODEL_RATE_MAX"] = str(args.model_rate_max)
+    if args.rate_limit is not None:
+        os.environ["FAKE_BEDROCK_RATE_LIMIT"] = str(args.rate_limit)
+    # every play has to reach the model to be comparable
+    os.environ.setdefault("COMMENTARY_CACHE_SIZE", "0")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("MAX_SESSIONS", str(max(args.sessions)))
+    sys.path.insert(0, root_dir)
+    sys.path.insert(0, os.path.join(root_dir, "lambda"))
+    os.chdir(root_dir)
+    import lambda_function
+
+    rows = load_rows()
+    benchmarks = args.only or ["generate_prompts", "get_commentaries", "lambda_handler", "ui"]
+    results = {}
+    # keep the metric lines the code under test prints out of the JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        if "generate_prompts" in benchmarks:
+            results['generate_prompts'] = bench_generate_prompts(lambda_function, rows, repeat=5)
+        if "get_commentaries" in benchmarks:
+            results['get_commentaries'] = bench_get_commentaries(lambda_function, rows, args.concurrency, args.plays)
+        if "lambda_handler" in benchmarks:
+            results['lambda_handler'] = bench_lambda_handler(lambda_function, rows, args.batch_sizes)
+        if "ui" in benchmarks:
+            import session_service
+            results['ui'] = bench_ui(session_service, lambda_function, rows, args.sessions, args.plays)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    report = {'meta': {'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'commit': commit, 'python': platform.python_version(),
+                       'platform': platform.platform(), 'fake_model': {'latency': args.latency, 'jitter': args.jitter,
+                                                                       'throttle_rate': args.throttle_rate, 'rate_limit': args.rate_limit,
+                                                                       'seed': args.seed},
+                       'model_rate_max': args.model_rate_max},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import csv
+import os
+import sys
+import time
+
+# run the lambda against the local fake model instead of Bedrock
+os.environ.setdefault("FAKE_BEDROCK_LATENCY", "0.5")
+# every run has to reach the model to be comparable
+os.environ.setdefault("COMMENTARY_CACHE_SIZE", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+import lambda_function
+
+sample_input_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "simulated_game.csv")
+
+
+def time_play(row, concurrency, prompt_mode="single"):
+    start = time.perf_counter()
+    lambda_function.get_commentaries(row, concurrency=concurrency, prompt_mode=prompt_mode)
+    return time.perf_counter() - start
+
+
+def main():
+    with open(sample_input_csv) as csv_file:
+        row = lambda_function.get_row_data(next(csv.DictReader(csv_file)))
+
+    latency = lambda_function.get_bedrock().latency
+    calls = len(lambda_function.generate_prompts(row))
+    print(f"{calls} model calls per play, {latency:.2f}s per call")
+    for concurrency in [1, 3, calls]:
+        elapsed = time_play(row, concurrency)
+        print(f"concurrency={concurrency}: {elapsed:.2f}s per play")
+    for prompt_mode in ["styles", "languages"]:
+        elapsed = time_play(row, calls, prompt_mode)
+        print(f"prompt_mode={prompt_mode}: {elapsed:.2f}s per play")
+
+
+if __name__ == "__main__":
+    main()
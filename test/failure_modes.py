@@ -0,0 +1,158 @@
+import base64
+import contextlib
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+# the checks run against the fake model and the local stream backend, without network access
+os.environ.setdefault("STREAM_BACKEND", "local")
+os.environ.setdefault("FAKE_BEDROCK_LATENCY", "0")
+os.environ.setdefault("BEDROCK_CLIENT_WARMUP", "0")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("PUT_RECORDS_MAX_ATTEMPTS", "2")
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root_dir)
+sys.path.insert(0, os.path.join(root_dir, "lambda"))
+os.chdir(root_dir)
+
+import lambda_function
+import stream_backend
+from commentary_cache import CommentaryCache, SqliteCommentaryStore
+from commentary_templates import render_commentaries
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+
+def load_rows():
+    with open(os.path.join("data", "simulated_game.csv")) as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def kinesis_event(rows, first_sequence_number):
+    return {'Records': [{'eventSource': 'aws:kinesis', 'kinesis': {
+        'partitionKey': 'failure-modes',
+        'sequenceNumber': str(first_sequence_number + offset),
+        'data': base64.b64encode(json.dumps(dict(row, sess_id='failure-modes')).encode('utf-8')).decode('utf-8'),
+        'approximateArrivalTimestamp': time.time()}} for offset, row in enumerate(rows)]}
+
+
+class FailingKinesisClient(object):
+    """ Kinesis client whose PutRecords requests fail as a whole """
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def put_records(self, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+def check_put_records_request_error(rows):
+    """ A PutRecords request that raises reports every record of the batch in batchItemFailures """
+    throttled = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'PutRecords')
+    for error in (throttled, EndpointConnectionError(endpoint_url="https://kinesis.us-east-1.amazonaws.com")):
+        client = FailingKinesisClient(error)
+        lambda_function.kinesis.client = client
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = lambda_function.lambda_handler(kinesis_event(rows[:3], 100), None)
+        finally:
+            lambda_function.kinesis.client = None
+        assert client.calls == stream_backend.put_records_max_attempts, client.calls
+        assert response['batchItemFailures'] == [{'itemIdentifier': str(100 + offset)} for offset in range(3)], response
+        print(f"put_records raising {type(error).__name__}: {len(response['batchItemFailures'])} batch item failures")
+
+
+def check_partial_row_templates(rows):
+    """ The templates and the fallback commentary describe a play whose row misses fields, e.g. the score """
+    combinations = [(style, language) for style in lambda_function.styles for language in lambda_function.languages]
+    partial_rows = 0
+    for row in rows:
+        row = {key: value for key, value in row.items() if key not in ('total_home_score', 'total_away_score')}
+        texts = render_commentaries(row, combinations, routine_only=False)
+        if texts is not None:
+            partial_rows += 1
+            assert all("{" not in text and "None" not in text for text in texts.values()), texts
+        for style, language in combinations:
+            assert lambda_function.fallback_commentary(row, style, language)
+    assert partial_rows, "no play was described by the templates"
+    print(f"rows without score: {partial_rows} of {len(rows)} plays described by the templates")
+
+
+def check_late_commentary_not_handed_over():
+    """ A model call that outlives its play deadline does not hand its commentary over once the play is done """
+    def generate_commentary_with_usage(prompt, max_tokens=50, on_text=None, deadline=None):
+        time.sleep(0.5 if prompt == "slow" else 0.01)
+        return f"commentary of {prompt}", lambda_function.new_usage()
+
+    handed_over = []
+    generate, call_timeout = lambda_function.generate_commentary_with_usage, lambda_function.commentary_call_timeout
+    lambda_function.generate_commentary_with_usage = generate_commentary_with_usage
+    lambda_function.commentary_call_timeout = 0.1
+    try:
+        prompts = ["fast", "slow"]
+        on_results = [lambda text, usage, prompt=prompt: handed_over.append(prompt) for prompt in prompts]
+        results = lambda_function.generate_all(prompts, [50, 50], 2, on_results, deadline=time.monotonic() + 0.1)
+        # the slow call ends after generate_all returned
+        time.sleep(0.6)
+    finally:
+        lambda_function.generate_commentary_with_usage = generate
+        lambda_function.commentary_call_timeout = call_timeout
+    assert results[1][0] is None, results
+    assert handed_over == ["fast"], handed_over
+    print(f"late model call: handed over {handed_over}, the slow commentary falls back")
+
+
+def check_hung_model_calls_share_one_bound():
+    """ A play whose model calls all hang ends at about its deadline, not after one call timeout per call """
+    def generate_commentary_with_usage(prompt, max_tokens=50, on_text=None, deadline=None):
+        time.sleep(2)
+        return f"commentary of {prompt}", lambda_function.new_usage()
+
+    generate, call_timeout = lambda_function.generate_commentary_with_usage, lambda_function.commentary_call_timeout
+    lambda_function.generate_commentary_with_usage = generate_commentary_with_usage
+    lambda_function.commentary_call_timeout = 0.3
+    try:
+        prompts = [f"hung {index}" for index in range(9)]
+        start = time.monotonic()
+        results = lambda_function.generate_all(prompts, [50] * len(prompts), len(prompts), deadline=start + 0.3)
+        elapsed = time.monotonic() - start
+    finally:
+        lambda_function.generate_commentary_with_usage = generate
+        lambda_function.commentary_call_timeout = call_timeout
+    assert all(text is None for text, _ in results), results
+    assert elapsed < 1, elapsed
+    print(f"hung model calls: {len(prompts)} calls fell back after {elapsed:.2f}s")
+
+
+def check_store_hit_keeps_its_age():
+    """ An entry promoted from the persistent tier to memory expires when it would have expired in the store """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = SqliteCommentaryStore(os.path.join(tmp_dir, "commentary_cache.db"), ttl=0.2)
+        store.put("key", "stored commentary")
+        time.sleep(0.1)
+        # a new container starts with an empty in-memory tier
+        cache = CommentaryCache(max_entries=16, ttl=0.2, store=store)
+        assert cache.get("key") == "stored commentary"
+        time.sleep(0.15)
+        assert cache.get("key") is None, "expired entry served from memory"
+        assert cache.get_stale("key") == "stored commentary"
+    print(f"cache store hit: expired after the ttl of the stored entry, {cache.stats()}")
+
+
+def main():
+    rows = load_rows()
+    check_put_records_request_error(rows)
+    check_partial_row_templates(rows)
+    check_store_hit_keeps_its_age()
+    check_late_commentary_not_handed_over()
+    check_hung_model_calls_share_one_bound()
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+lambda_dir = os.path.join(root_dir, "lambda")
+# module imported, directory it is imported from, and the environment it needs; the bedrock client
+# warmup thread is disabled so that only the import is measured
+targets = {
+    "lambda_function": (lambda_dir, {"STREAM_BACKEND": "local", "BEDROCK_CLIENT_WARMUP": "0"}),
+    "app": (root_dir, {"STREAM_BACKEND": "local"}),
+    "session_service": (root_dir, {"STREAM_BACKEND": "local"}),
+}
+
+
+def parse_importtime(stderr):
+    """
+    :param stderr: output of python -X importtime
+    :return: list of (module, depth, self_us, cumulative_us) in import order
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return modules
+
+
+def profile(module, env, runs):
+    """
+    Imports the module in fresh interpreters.
+    :param module: name of the module
+    :param env: environment variables set for the import
+    :param runs: number of interpreters, the fastest run is reported
+    :return: wall seconds of the import and the parse_importtime list of the fastest run
+    """
+    cwd, target_env = targets[module]
+    child_env = dict(os.environ, PYTHONPATH=os.pathsep.join([root_dir, lambda_dir]),
+                     AWS_DEFAULT_REGION=os.getenv("AWS_DEFAULT_REGION", "us-east-1"))
+    child_env.update(target_env)
+    child_env.update(env)
+    # __name__ is not __main__, so app.py does not launch the UI
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    best = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd, env=child_env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            sys.exit(result.stderr)
+        elapsed = float(result.stdout.strip().splitlines()[-1])
+        if best is None or elapsed < best[0]:
+            best = (elapsed, parse_importtime(result.stderr))
+    return best
+
+
+def report(module, elapsed, modules, top):
+    """
+    :return: dictionary of the import time, the cost of the modules imported directly by the
+             module and the modules with the largest self time, in milliseconds
+    """
+    # a module is listed after its imports, so they follow the preceding top level entry
+    end = max(index for index, entry in enumerate(modules) if entry[0] == module and entry[1] == 0)
+    start = max([index for index, entry in enumerate(modules[:end]) if entry[1] == 0], default=-1) + 1
+    modules = modules[start:end + 1]
+    direct = [entry for entry in modules if entry[1] == 1]
+    return {
+        "module": module,
+        "import_ms": round(elapsed * 1000, 1),
+        "modules": len(modules),
+        "direct_imports_ms": {name: round(cumulative / 1000, 1) for name, _, _, cumulative
+                              in sorted(direct, key=lambda entry: -entry[3])[:top]},
+        "self_ms": {name: round(self_us / 1000, 1) for name, _, self_us, _
+                    in sorted(modules, key=lambda entry: -entry[2])[:top]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-module import cost of the lambda function and the app")
+    parser.add_argument("--modules", help="modules to profile", nargs="+", choices=sorted(targets),
+                        default=sorted(targets))
+    parser.add_argument("--env", help="extra NAME=VALUE environment variables", nargs="*", default=[])
+    parser.add_argument("--runs", help="fresh interpreters per module, the fastest is reported", type=int, default=3)
+    parser.add_argument("--top", help="number of modules listed", type=int, default=10)
+    parser.add_argument("--json", help="print the results as JSON", action="store_true")
+    args = parser.parse_args()
+
+    env = dict(item.split("=", 1) for item in args.env)
+    results = []
+    for module in args.modules:
+        elapsed, modules = profile(module, env, args.runs)
+        results.append(report(module, elapsed, modules, args.top))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(f"{result['module']}: {result['import_ms']} ms, {result['modules']} modules")
+        print("  cumulative cost of its imports:")
+        for name, ms in result["direct_imports_ms"].items():
+            print(f"    {ms:8.1f} ms  {name}")
+        print("  largest self time:")
+        for name, ms in result["self_ms"].items():
+            print(f"    {ms:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
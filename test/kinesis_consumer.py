@@ -1,9 +1,13 @@
-import boto3
 from botocore.exceptions  import ClientError
 import os
+import sys
 import datetime
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from stream_backend import get_kinesis_client
+
 kinesis_data_stream_key = "SPORT_DATA_LIVE_COMMENTARIES_STREAM"
 kinesis_data_stream = os.getenv(kinesis_data_stream_key, "sports-data-live-commentaries")
 shard_id = "shardId-000000000000"
@@ -21,7 +25,7 @@ def main():
     stream_name = kinesis_data_stream
 
     try:
-        kinesis_client = boto3.client('kinesis')
+        kinesis_client = get_kinesis_client()
 
         # ------------------
         # Get the shard ID.
@@ -0,0 +1,233 @@
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+# run every stage against the local stream backend and the fake model instead of AWS
+os.environ.setdefault("STREAM_BACKEND", "local")
+os.environ.setdefault("FAKE_BEDROCK_LATENCY", "0.5")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import session_service
+import lambda_function
+from game_simulator import KinesisStream, SimulatorEngine, kinesis_data_stream as source_stream
+from stream_backend import get_kinesis_client
+from tracing import TraceRecorder, trace_stages
+
+
+class TimedStreamConsumer(session_service.RunnableKinesisStreamConsumer):
+    """
+    UI consumer that counts a play as displayed once its first commentary for the default style
+    and language reaches a session's inbox, ordering and merging the records like the UI. It
+    also counts the plays displayed after a later play of their game.
+    """
+
+    def __init__(self, recorder):
+        super(TimedStreamConsumer, self).__init__()
+        self.recorder = recorder
+        self.displayed = 0
+        self.out_of_order = 0
+        self.last_play_seq = {}
+        self.user_states = {}
+        self.display_lock = threading.Lock()
+
+    def display(self, json_record, user_state):
+        if not session_service.merge_record(json_record, session_service.find_commentary(json_record, user_state), user_state):
+            return
+        json_record['trace']['ui_deliver'] = round(time.time(), 3)
+        self.recorder.record(json_record)
+        self.displayed += 1
+        game_id = json_record.get('game_id')
+        if json_record.get('play_seq', 0) < self.last_play_seq.get(game_id, -1):
+            self.out_of_order += 1
+        self.last_play_seq[game_id] = max(json_record.get('play_seq', 0), self.last_play_seq.get(game_id, -1))
+
+    def is_registered(self, sess_id):
+        # the sessions of the simulated games are not registered, all of them are watched
+        return True
+
+    def dispatch(self, json_record):
+        with self.display_lock:
+            user_state = self.user_states.setdefault(json_record.get('sess_id'), {})
+            for ordered_record in session_service.sequence_record(json_record, session_service.find_commentary(json_record, user_state), user_state):
+                self.display(ordered_record, user_state)
+        super(TimedStreamConsumer, self).dispatch(json_record)
+
+    def release_held(self):
+        """ Displays the plays held back longer than REORDER_MAX_WAIT, like the UI does between records """
+        with self.display_lock:
+            for user_state in self.user_states.values():
+                for ordered_record in session_service.get_play_order(user_state).release():
+                    self.display(ordered_record, user_state)
+
+    def order_stats(self):
+        stats = {'held': 0, 'skipped': 0, 'late': 0}
+        for user_state in self.user_states.values():
+            for key, value in session_service.get_play_order(user_state).stats().items():
+                stats[key] += value
+        return stats
+
+
+class LambdaPoller(threading.Thread):
+    """
+    Plays the role of the Kinesis event source mapping: reads the source stream in batches,
+    invokes lambda_handler with Kinesis events and retries from the first reported failure.
+    Like the event source mapping, it reads a child shard only after its parents are read
+    to their end.
+    """
+
+    def __init__(self, batch_size):
+        super(LambdaPoller, self).__init__(daemon=True)
+        self.batch_size = batch_size
+        self.client = get_kinesis_client()
+        self.stopped = threading.Event()
+        self.batches = 0
+        self.records = 0
+        self.retries = 0
+        self.handler_seconds = 0
+
+    def event(self, shard_id, records):
+        return {'Records': [{
+            'eventSource': 'aws:kinesis',
+            'eventID': f"{shard_id}:{record['SequenceNumber']}",
+            'kinesis': {
+                'kinesisSchemaVersion': '1.0',
+                'partitionKey': record['PartitionKey'],
+                'sequenceNumber': record['SequenceNumber'],
+                'data': base64.b64encode(record['Data']).decode('utf-8'),
+                'approximateArrivalTimestamp': record['ApproximateArrivalTimestamp'].timestamp(),
+            },
+        } for record in records]}
+
+    def invoke(self, shard_id, records):
+        """ :return: sequence number to retry from, or None if the batch succeeded """
+        start = time.perf_counter()
+        # the handler prints every payload and commentary, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = lambda_function.lambda_handler(self.event(shard_id, records), None)
+        self.handler_seconds += time.perf_counter() - start
+        self.batches += 1
+        self.records += len(records)
+        failures = response.get('batchItemFailures', [])
+        if not failures:
+            return None
+        self.retries += 1
+        return min((failure['itemIdentifier'] for failure in failures), key=int)
+
+    def add_ready_shards(self, iterators, finished):
+        """ Starts reading the shards whose parents are finished """
+        for shard in self.client.list_shards(StreamName=source_stream)['Shards']:
+            shard_id = shard['ShardId']
+            parents = [shard.get('ParentShardId'), shard.get('AdjacentParentShardId')]
+            if shard_id in iterators or shard_id in finished or any(parent and parent not in finished for parent in parents):
+                continue
+            iterators[shard_id] = self.client.get_shard_iterator(
+                StreamName=source_stream, ShardId=shard_id, ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+
+    def run(self):
+        iterators, finished = {}, set()
+        self.add_ready_shards(iterators, finished)
+        last_listing = time.time()
+        while not self.stopped.is_set():
+            idle = True
+            for shard_id, iterator in list(iterators.items()):
+                response = self.client.get_records(ShardIterator=iterator, Limit=self.batch_size)
+                if response['NextShardIterator'] is None:
+                    finished.add(shard_id)
+                    iterators.pop(shard_id)
+                    self.add_ready_shards(iterators, finished)
+                    continue
+                if not response['Records']:
+                    continue
+                idle = False
+                retry_from = self.invoke(shard_id, response['Records'])
+                if retry_from is None:
+                    iterators[shard_id] = response['NextShardIterator']
+                else:
+                    iterators[shard_id] = self.client.get_shard_iterator(
+                        StreamName=source_stream, ShardId=shard_id, ShardIteratorType='AT_SEQUENCE_NUMBER',
+                        StartingSequenceNumber=retry_from)['ShardIterator']
+            if time.time() - last_listing > 1:
+                self.add_ready_shards(iterators, finished)
+                last_listing = time.time()
+            if idle:
+                self.stopped.wait(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs simulator, lambda function and UI consumer on one box")
+    parser.add_argument("--games", help="number of concurrent games", type=int, default=4)
+    parser.add_argument("--speed", help="time compression of the games, 0 for as fast as possible",
+                        type=float, default=100)
+    parser.add_argument("--duration", help="seconds of game time per game", type=int, default=300)
+    parser.add_argument("--batch_size", help="records per lambda invocation", type=int, default=100)
+    parser.add_argument("--timeout", help="seconds to wait for the last commentary", type=float, default=120)
+    parser.add_argument("--trace_log", help="optional file the traces are appended to, see test/trace_report.py")
+    parser.add_argument("--shards", help="shards of both streams", type=int, default=1)
+    parser.add_argument("--reshard_after", help="seconds after which both streams are resharded to twice the shards",
+                        type=float)
+    args = parser.parse_args()
+
+    client = get_kinesis_client()
+    for stream in (source_stream, session_service.kinesis_data_stream):
+        client.create_stream(StreamName=stream, ShardCount=args.shards)
+
+    recorder = TraceRecorder(args.trace_log)
+    consumer = TimedStreamConsumer(recorder)
+    sessions = [f"local-{game}" for game in range(args.games)]
+    for sess_id in sessions:
+        consumer.register(sess_id)
+    consumer.start()
+    # the consumer starts reading at the tip of the commentary stream
+    while len(consumer.readers) == 0:
+        time.sleep(0.01)
+
+    poller = LambdaPoller(args.batch_size)
+    poller.start()
+    engine = SimulatorEngine(KinesisStream(source_stream))
+    start = time.time()
+    for game, sess_id in enumerate(sessions):
+        engine.start_game(game, sess_id=sess_id, speed=args.speed, duration=args.duration)
+    if args.reshard_after is not None:
+        time.sleep(args.reshard_after)
+        for stream in (source_stream, session_service.kinesis_data_stream):
+            client.update_shard_count(StreamName=stream, TargetShardCount=args.shards * 2)
+    engine.wait()
+    engine.shutdown()
+
+    deadline = time.time() + args.timeout
+    while consumer.displayed < engine.sent and time.time() < deadline:
+        consumer.release_held()
+        time.sleep(0.1)
+    elapsed = time.time() - start
+    poller.stopped.set()
+    poller.join()
+    consumer.shutdown()
+    recorder.close()
+
+    print(f"{args.games} games at speed {args.speed}, fake model latency {os.environ['FAKE_BEDROCK_LATENCY']}s")
+    print(f"plays ingested: {engine.sent}, displayed: {consumer.displayed} in {elapsed:.1f}s "
+          f"({consumer.displayed / elapsed:.1f} plays/s)")
+    print(f"ordering: {consumer.out_of_order} plays displayed out of order, {json.dumps(consumer.order_stats())}")
+    print(f"lambda: {poller.batches} batches, {poller.records / max(poller.batches, 1):.1f} records per batch, "
+          f"{poller.handler_seconds:.1f}s in the handler, {poller.retries} retried")
+    print(f"commentary stream: {lambda_function.kinesis.sent_bytes / max(poller.records, 1):.0f} bytes per play "
+          f"published ({lambda_function.commentary_wire_format})")
+    summary = recorder.summary()
+    print(f"{'stage':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage in [stage for stage, _, _ in trace_stages] + ['model', 'model_call']:
+        if stage in summary:
+            row = summary[stage]
+            print(f"{stage:<12}{row['count']:>7}{row['p50']:>10.0f}{row['p95']:>10.0f}{row['p99']:>10.0f}{row['max']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
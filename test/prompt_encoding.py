@@ -0,0 +1,63 @@
+import argparse
+import csv
+import os
+import sys
+import time
+
+# run the lambda against the local fake model instead of Bedrock, with a latency that grows with the prompt
+os.environ.setdefault("FAKE_BEDROCK_LATENCY", "0.2")
+os.environ.setdefault("FAKE_BEDROCK_INPUT_TOKEN_LATENCY", "0.002")
+# every run has to reach the model to be comparable
+os.environ.setdefault("COMMENTARY_CACHE_SIZE", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+import lambda_function
+
+sample_input_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "simulated_game.csv")
+encodings = ["json", "compact"]
+
+
+def prompt_tokens(rows, encoding, prompt_mode):
+    """ :return: estimated prompt tokens of every play, summed over the prompts of the play """
+    tokens = []
+    for row in rows:
+        row = lambda_function.get_row_data(row)
+        if prompt_mode == "single":
+            prompt_objs = lambda_function.generate_prompts(row, encoding=encoding)
+        else:
+            prompt_objs = lambda_function.generate_multi_prompts(row, prompt_mode, encoding=encoding)
+        tokens.append(sum(prompt_obj['prompt_tokens'] for prompt_obj in prompt_objs))
+    return tokens
+
+
+def play_latency(rows, encoding, prompt_mode):
+    """ :return: mean seconds get_commentaries takes for a play """
+    lambda_function.prompt_encoding = encoding
+    start = time.perf_counter()
+    for row in rows:
+        lambda_function.get_commentaries(lambda_function.get_row_data(row), prompt_mode=prompt_mode)
+    return (time.perf_counter() - start) / len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the prompt tokens and model latency of the play encodings")
+    parser.add_argument("--plays", help="plays timed per encoding, 0 only counts tokens", type=int, default=5)
+    parser.add_argument("--prompt_mode", help="single, styles or languages", default="single")
+    args = parser.parse_args()
+
+    with open(sample_input_csv) as csv_file:
+        rows = list(csv.DictReader(csv_file))
+
+    print(f"{len(rows)} plays, prompt_mode={args.prompt_mode}")
+    print(f"{'encoding':<10}{'tokens/play':>12}{'max':>8}{'latency/play':>14}")
+    for encoding in encodings:
+        tokens = prompt_tokens(rows, encoding, args.prompt_mode)
+        latency = ""
+        if args.plays:
+            latency = f"{play_latency(rows[:args.plays], encoding, args.prompt_mode):.2f}s"
+        print(f"{encoding:<10}{sum(tokens) / len(tokens):>12.1f}{max(tokens):>8}{latency:>14}")
+
+
+if __name__ == "__main__":
+    main()
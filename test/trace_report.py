@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tracing import trace_durations, trace_stages
+
+
+def read_traces(paths):
+    """
+    Reads the trace lines from TRACE_LOG files or exported logs, where the JSON may follow a log prefix.
+    :param paths: files to read, "-" reads stdin
+    :return: list of trace log entries
+    """
+    traces = []
+    for path in paths:
+        with (sys.stdin if path == "-" else open(path)) as log_file:
+            for line in log_file:
+                if '"metric": "trace"' not in line:
+                    continue
+                try:
+                    traces.append(json.loads(line[line.index("{"):]))
+                except ValueError:
+                    continue
+    return traces
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, max(0, int(round(len(values) * p / 100)) - 1))]
+
+
+def report(traces):
+    """
+    :param traces: trace log entries
+    :return: dictionary of the count, p50, p95, p99, max and mean in milliseconds of every stage
+    """
+    samples = {}
+    for entry in traces:
+        model_calls = entry.get('model_calls') or []
+        for stage, duration in trace_durations(entry['trace'], model_calls).items():
+            samples.setdefault(stage, []).append(duration)
+        for start, end in model_calls:
+            samples.setdefault('model_call', []).append((end - start) * 1000)
+
+    stages = {}
+    for stage in [stage for stage, _, _ in trace_stages] + ['model', 'model_call']:
+        if stage not in samples:
+            continue
+        values = sorted(samples[stage])
+        stages[stage] = {'count': len(values), 'p50': round(percentile(values, 50), 1),
+                         'p95': round(percentile(values, 95), 1), 'p99': round(percentile(values, 99), 1),
+                         'max': round(values[-1], 1), 'mean': round(sum(values) / len(values), 1)}
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency report of the traces written to TRACE_LOG")
+    parser.add_argument("paths", nargs="+", help="trace log files, - for stdin")
+    parser.add_argument("--json", help="print the report as JSON", action="store_true")
+    args = parser.parse_args()
+
+    stages = report(read_traces(args.paths))
+    if args.json:
+        print(json.dumps(stages, indent=2))
+        return
+    total = stages.get('total', {}).get('mean')
+    print(f"{'stage':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'of total':>10}")
+    for stage, row in stages.items():
+        share = f"{row['mean'] / total:.0%}" if total and stage not in ('total', 'model_call') else ""
+        print(f"{stage:<12}{row['count']:>7}{row['p50']:>10.0f}{row['p95']:>10.0f}{row['p99']:>10.0f}"
+              f"{row['max']:>10.0f}{share:>10}")
+
+
+if __name__ == "__main__":
+    main()
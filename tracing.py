@@ -0,0 +1,141 @@
+import json
+import math
+import os
+import threading
+
+trace_log_key = "TRACE_LOG"
+# timestamps a record collects on its way from the simulator to the browser, in order
+trace_stamps = ['emit', 'source_arrival', 'lambda_receive', 'generated', 'publish',
+                'commentary_arrival', 'consumer_read', 'ui_deliver']
+# stages measured between two consecutive timestamps
+trace_stages = [
+    ('ingest', 'emit', 'source_arrival'),            # simulator buffer and PutRecords into the source stream
+    ('trigger', 'source_arrival', 'lambda_receive'),  # event source mapping batching and record queueing
+    ('generate', 'lambda_receive', 'generated'),      # prompts and model calls of the play
+    ('batch_wait', 'generated', 'publish'),           # waiting for the other records of the lambda batch
+    ('publish', 'publish', 'commentary_arrival'),     # PutRecords into the commentary stream
+    ('consumer', 'commentary_arrival', 'consumer_read'),  # shard reader polling
+    ('ui', 'consumer_read', 'ui_deliver'),            # session inbox until the UI renders the play
+    ('total', 'emit', 'ui_deliver'),
+]
+
+
+def trace_durations(trace, model_calls=()):
+    """
+    :param trace: dictionary of the wall clock timestamps of a record, in seconds
+    :param model_calls: (start, end) timestamps of the model calls of the record
+    :return: dictionary of stage durations in milliseconds, stages with a missing timestamp are left out
+    """
+    durations = {}
+    for stage, start, end in trace_stages:
+        if trace.get(start) is not None and trace.get(end) is not None:
+            durations[stage] = (trace[end] - trace[start]) * 1000
+    if model_calls:
+        durations['model'] = (max(end for _, end in model_calls) - min(start for start, _ in model_calls)) * 1000
+    return durations
+
+
+class LatencyHistogram(object):
+    """
+    Latency histogram with logarithmic buckets, each 5% wider than the previous one.
+
+    Memory does not grow with the number of samples and percentiles are accurate to the
+    bucket width.
+    """
+    __slots__ = ('buckets', 'count', 'total', 'max')
+    growth = 1.05
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """ :param value: latency in milliseconds """
+        value = max(value, 0.0)
+        bucket = int(math.log(value + 1, self.growth))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """
+        :param p: percentile between 0 and 100
+        :return: upper bound of the bucket holding the percentile, None if the histogram is empty
+        """
+        if self.count == 0:
+            return None
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.growth ** (bucket + 1) - 1, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'p50': round(self.percentile(50) or 0, 1), 'p95': round(self.percentile(95) or 0, 1),
+                'p99': round(self.percentile(99) or 0, 1), 'max': round(self.max, 1),
+                'mean': round(self.total / self.count, 1) if self.count else 0}
+
+
+class TraceRecorder(object):
+    """
+    Aggregates the traces of the delivered records into a histogram per stage.
+
+    Every trace can also be appended to a JSON lines file, see test/trace_report.py.
+    """
+
+    def __init__(self, log_path=None):
+        """
+        :param log_path: optional file every trace is appended to
+        """
+        self.log_path = log_path
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self._log = None
+
+    def record(self, json_record):
+        """
+        :param json_record: commentary record carrying a 'trace', records without one are ignored
+        """
+        trace = json_record.get('trace')
+        if not trace:
+            return
+        model_calls = [commentary_obj['model_call'] for commentary_obj in json_record.get('commentary_objs', [])
+                       if commentary_obj.get('model_call')]
+        durations = trace_durations(trace, model_calls)
+        with self.lock:
+            for stage, duration in durations.items():
+                self.histograms.setdefault(stage, LatencyHistogram()).add(duration)
+            for start, end in model_calls:
+                self.histograms.setdefault('model_call', LatencyHistogram()).add((end - start) * 1000)
+            if self.log_path is not None:
+                if self._log is None:
+                    self._log = open(self.log_path, 'a')
+                self._log.write(json.dumps({'metric': 'trace', 'sess_id': json_record.get('sess_id'),
+                                            'trace': trace, 'model_calls': model_calls}) + "\n")
+                self._log.flush()
+
+    def summary(self):
+        """
+        :return: dictionary of the count, p50, p95, p99, max and mean in milliseconds of every stage
+        """
+        with self.lock:
+            return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def close(self):
+        with self.lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+def get_trace_recorder():
+    """
+    :return: a TraceRecorder logging to TRACE_LOG if it is set
+    """
+    return TraceRecorder(os.getenv(trace_log_key))
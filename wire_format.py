@@ -0,0 +1,69 @@
+import json
+import struct
+import zlib
+
+# first byte of a binary record; a JSON record starts with "{"
+wire_magic = 0xC5
+wire_version = 1
+compressed_flag = 0x01
+# magic, version, flags and length of the session ID that follows the header
+header = struct.Struct(">BBBH")
+
+
+def encode_record(record, compress_threshold=None):
+    """
+    Encodes a commentary record for the stream.
+
+    The record is laid out as a fixed header, the session ID and the body. The body is the
+    rest of the record as compact JSON, compressed with zlib if it is larger than
+    compress_threshold bytes and compression makes it smaller. The session ID is outside
+    the body, so a consumer can skip the records of other sessions with peek_session.
+    :param record: commentary record, JSON serializable
+    :param compress_threshold: body size in bytes above which the body is compressed, None never compresses
+    :return: encoded record
+    """
+    sess_id = record.get('sess_id')
+    sess_id = b"" if sess_id is None else str(sess_id).encode('utf-8')
+    body = json.dumps({key: value for key, value in record.items() if key != 'sess_id'},
+                      separators=(',', ':')).encode('utf-8')
+    flags = 0
+    if compress_threshold is not None and len(body) > compress_threshold:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body, flags = compressed, compressed_flag
+    return header.pack(wire_magic, wire_version, flags, len(sess_id)) + sess_id + body
+
+
+def is_binary(data):
+    return len(data) >= header.size and data[0] == wire_magic
+
+
+def peek_session(data):
+    """
+    :param data: encoded record
+    :return: the record's session ID, "" if it has none, or None for a JSON record, which
+             has to be decoded to find out
+    """
+    if not is_binary(data):
+        return None
+    _, _, _, sess_id_length = header.unpack_from(data)
+    return bytes(data[header.size:header.size + sess_id_length]).decode('utf-8')
+
+
+def decode_record(data):
+    """
+    :param data: record encoded by encode_record, or plain JSON
+    :return: the record as a dictionary
+    """
+    if not is_binary(data):
+        return json.loads(data)
+    _, version, flags, sess_id_length = header.unpack_from(data)
+    if version != wire_version:
+        raise ValueError(f"Unsupported wire format version {version}")
+    body = data[header.size + sess_id_length:]
+    if flags & compressed_flag:
+        body = zlib.decompress(body)
+    record = json.loads(body)
+    if sess_id_length:
+        record['sess_id'] = bytes(data[header.size:header.size + sess_id_length]).decode('utf-8')
+    return record